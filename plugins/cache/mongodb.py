@@ -44,27 +44,476 @@ options:
           - key: fact_caching_timeout
             section: defaults
         type: integer
+    _write_behind:
+        description:
+            - Buffer the facts written by the cache and send them as a single bulk write instead of one
+              round trip per host.
+            - Buffered facts are written once O(_write_behind_size) hosts are pending, once the oldest
+              pending write is O(_write_behind_interval) seconds old, before any call reading the whole
+              collection and when the controller exits.
+            - Only the latest value of a host is written, so the writes of a given host are never reordered.
+        default: false
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_WRITE_BEHIND
+        ini:
+          - key: fact_caching_mongodb_write_behind
+            section: defaults
+        type: boolean
+    _write_behind_size:
+        description: Number of pending hosts triggering a bulk write when O(_write_behind) is enabled.
+        default: 100
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_WRITE_BEHIND_SIZE
+        ini:
+          - key: fact_caching_mongodb_write_behind_size
+            section: defaults
+        type: integer
+    _write_behind_interval:
+        description:
+            - Age in seconds of the oldest pending write triggering a bulk write when O(_write_behind) is enabled.
+            - This is checked each time facts are written, there is no background flush.
+        default: 5
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_WRITE_BEHIND_INTERVAL
+        ini:
+          - key: fact_caching_mongodb_write_behind_interval
+            section: defaults
+        type: integer
+    _prefetch:
+        description:
+            - Load the facts of every host stored with O(_prefix) using a single query on the first lookup,
+              instead of one query per host.
+            - Later lookups, including for hosts without cached facts, are then answered from memory.
+        default: false
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_PREFETCH
+        ini:
+          - key: fact_caching_mongodb_prefetch
+            section: defaults
+        type: boolean
+    _compression:
+        description:
+            - Compress the facts of each host before storing them, as a BSON Binary tagged with the codec used.
+            - Documents are decoded according to their own tag, so plain documents written with C(none) and documents
+              written with another codec can still be read after changing this option.
+            - C(bz2) and C(lzma) require a Python built with their libraries, C(zstd) requires Python 3.14 or newer.
+        default: none
+        choices: ['none', 'zlib', 'bz2', 'lzma', 'zstd']
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_COMPRESSION
+        ini:
+          - key: fact_caching_mongodb_compression
+            section: defaults
+        type: string
+    _delta_updates:
+        description:
+            - Only send the facts which changed since they were last read or written by the plugin,
+              as C($set) and C($unset) of the matching C(data.<path>) fields, instead of rewriting the whole document.
+            - Hosts whose facts were not read or written yet by the plugin are written in full.
+            - A copy of the facts last stored for each host is kept in memory to compute the changes.
+            - Can not be used with unacknowledged writes, O(_write_concern_w=0).
+            - Ignored when O(_compression) is enabled. ansible-core 2.19 and newer serialize the facts of a host
+              into a single value before handing them to the plugin, so each change is a full rewrite there.
+        default: false
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_DELTA_UPDATES
+        ini:
+          - key: fact_caching_mongodb_delta_updates
+            section: defaults
+        type: boolean
+    _batch_size:
+        description: Number of documents fetched per round trip when reading the facts of several hosts at once.
+        default: 1000
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_BATCH_SIZE
+        ini:
+          - key: fact_caching_mongodb_batch_size
+            section: defaults
+        type: integer
+    _read_preference:
+        description:
+            - Read preference of the cache queries, overriding the one of the connection string.
+            - Reads from secondaries may not see facts written moments before by another controller process.
+        choices: ['primary', 'primaryPreferred', 'secondary', 'secondaryPreferred', 'nearest']
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_READ_PREFERENCE
+        ini:
+          - key: fact_caching_mongodb_read_preference
+            section: defaults
+        type: string
+    _max_staleness_seconds:
+        description:
+            - Maximum replication lag, in seconds, of the secondaries the cache may read from.
+            - Requires O(_read_preference) to be set to a value other than C(primary).
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_MAX_STALENESS_SECONDS
+        ini:
+          - key: fact_caching_mongodb_max_staleness_seconds
+            section: defaults
+        type: integer
+    _write_concern_w:
+        description:
+            - The C(w) write concern of the cache writes, overriding the one of the connection string.
+            - A number of members such as C(1), or C(0) for unacknowledged writes, or a tag set name such as C(majority).
+            - Failed writes are not reported with C(0).
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_WRITE_CONCERN_W
+        ini:
+          - key: fact_caching_mongodb_write_concern_w
+            section: defaults
+        type: string
+    _journal:
+        description: Whether the cache writes wait for the on-disk journal, overriding the connection string.
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_JOURNAL
+        ini:
+          - key: fact_caching_mongodb_journal
+            section: defaults
+        type: boolean
+    _buckets:
+        description:
+            - Number of collections the facts are spread over. With more than one, the facts of a host are stored in the
+              collection C(cache_<n>), where C(n) is a hash of its key, rather than in C(cache).
+            - Operations on a single host only use its own collection, operations on every host query all of them concurrently.
+            - Facts stored with a different number of buckets are not found, changing this option starts from an empty cache.
+        default: 1
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_BUCKETS
+        ini:
+          - key: fact_caching_mongodb_buckets
+            section: defaults
+        type: integer
+    _local_cache_path:
+        description:
+            - Path of a SQLite file keeping a local copy of the facts read from or written to MongoDB, shared by
+              consecutive runs on the controller. Disabled when not set.
+            - Facts copied less than O(_local_cache_max_age) seconds ago are served without contacting MongoDB. Older
+              copies are served as well, while a single background thread refreshes them from MongoDB for the next run,
+              fetching the stale hosts together. Refreshes still queued when Ansible exits are dropped.
+            - Copies of facts older than O(_timeout) are never served.
+            - The file is created readable by its owner only.
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_LOCAL_CACHE_PATH
+        ini:
+          - key: fact_caching_mongodb_local_cache_path
+            section: defaults
+        type: path
+    _local_cache_max_age:
+        description: Age in seconds after which a copy of the facts in O(_local_cache_path) is refreshed from MongoDB.
+        default: 300
+        env:
+          - name: ANSIBLE_CACHE_MONGODB_LOCAL_CACHE_MAX_AGE
+        ini:
+          - key: fact_caching_mongodb_local_cache_max_age
+            section: defaults
+        type: integer
+notes:
+    - O(_prefix) scopes every operation, C(keys), C(copy) and C(flush) only see or remove the documents
+      stored with that prefix, so several teams can share a collection using distinct prefixes.
+    - 'The cache collection can be sharded with a hashed shard key on C(_id), for example
+      C(sh.shardCollection("ansible.cache", {_id: "hashed"})). Every operation on a single host filters on C(_id)
+      and is routed to one shard.'
 '''
 
+import atexit
+import copy
 import datetime
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+import zlib
 
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
 from ansible import constants as C
 from ansible.errors import AnsibleError
 from ansible.plugins.cache import BaseCacheModule
 from ansible.utils.display import Display
-from ansible.module_utils.common.text.converters import to_native
+from ansible.module_utils.common.text.converters import to_bytes, to_native
 
 pymongo_missing = False
 
 try:
+    import bson
     import pymongo
 except ImportError:
     pymongo_missing = True
 
 display = Display()
 
+# Read preferences other than primary for the _read_preference option
+_read_preferences = {}
+if not pymongo_missing:
+    _read_preferences = {
+        'primaryPreferred': pymongo.read_preferences.PrimaryPreferred,
+        'secondary': pymongo.read_preferences.Secondary,
+        'secondaryPreferred': pymongo.read_preferences.SecondaryPreferred,
+        'nearest': pymongo.read_preferences.Nearest,
+    }
+
+# Compression codecs for the _compression option, name -> (compress, decompress)
+_codecs = {
+    'zlib': (zlib.compress, zlib.decompress),
+}
+
+# bz2 and lzma are missing from Python builds without libbz2 or liblzma
+try:
+    import bz2
+    _codecs['bz2'] = (bz2.compress, bz2.decompress)
+except ImportError:
+    pass
+
+try:
+    import lzma
+    _codecs['lzma'] = (lzma.compress, lzma.decompress)
+except ImportError:
+    pass
+
+try:
+    from compression import zstd  # Python 3.14+
+    _codecs['zstd'] = (zstd.compress, zstd.decompress)
+except ImportError:
+    pass
+
+# MongoClient instances shared by every CacheModule of this process, keyed by (pid, uri)
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(uri):
+    '''
+    Returns the MongoClient for uri owned by the current process, creating it on first use.
+    Clients inherited from a parent process are discarded rather than reused, as pymongo
+    is not fork safe. The child lazily builds its own client on its first cache call.
+    '''
+    pid = os.getpid()
+    with _clients_lock:
+        client = _clients.get((pid, uri))
+        if client is None:
+            for key in [k for k in _clients if k[0] != pid]:
+                # Never close a client from another process, its sockets belong to the parent
+                del _clients[key]
+            client = pymongo.MongoClient(uri)
+            _clients[(pid, uri)] = client
+    return client
+
+
+def _close_clients():
+    pid = os.getpid()
+    with _clients_lock:
+        for key in [k for k in _clients if k[0] == pid]:
+            _clients.pop(key).close()
+
+
+# Markers of the ttl indexes already reconciled by this process, (uri, collection, timeout),
+# and the events of the reconciliations in progress. The lock is never held across a network call.
+_reconciled_indexes = set()
+_reconciling_indexes = {}
+_indexes_lock = threading.Lock()
+
+# CacheModule instances that may hold buffered writes, see the _write_behind option
+_write_behind_caches = weakref.WeakSet()
+
+
+def _flush_write_behind():
+    for cache in list(_write_behind_caches):
+        try:
+            cache._flush_pending()
+        except AnsibleError as excep:
+            display.error(to_native(excep))
+
+
+class _Refresher:
+    '''
+    Refreshes the stale _local_cache_path copies in the background, on a single worker thread
+    per process. Hosts queued meanwhile are fetched together, see CacheModule._refresh.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = []
+        self._queued = set()
+        self._thread = None
+        self._stopped = False
+
+    def add(self, cache, key):
+        marker = (cache._connection, cache._make_key(key))
+        with self._lock:
+            if self._stopped or marker in self._queued:
+                return
+            self._queued.add(marker)
+            self._queue.append((cache, key, time.time()))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                queue = self._queue
+                self._queue = []
+                if not queue or self._stopped:
+                    self._thread = None
+                    return
+            caches = {}
+            for cache, key, since in queue:
+                caches.setdefault(id(cache), (cache, []))[1].append((key, since))
+            for cache, entries in caches.values():
+                cache._refresh(entries)
+            with self._lock:
+                for cache, key, since in queue:
+                    self._queued.discard((cache._connection, cache._make_key(key)))
+
+    def join(self, timeout=5, stop=False):
+        '''
+        Waits for the queued refreshes. With stop, only for the batch being fetched, the others are dropped.
+        '''
+        with self._lock:
+            self._stopped = stop
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+
+_refresher = _Refresher()
+
+
+def _join_refresh_threads(timeout=5):
+    _refresher.join(timeout)
+
+
+def _stop_refreshes():
+    _refresher.join(stop=True)
+
+
+def _reset_after_fork():
+    '''
+    Gives a forked worker its own locks and refresher, a thread of the parent may hold them at fork time
+    '''
+    global _clients_lock, _indexes_lock, _refresher
+    _clients_lock = threading.Lock()
+    _indexes_lock = threading.Lock()
+    _reconciling_indexes.clear()
+    _refresher = _Refresher()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _epoch(date):
+    '''
+    Returns the epoch of a naive UTC datetime, as stored in the date field of the cache documents,
+    or the current time for documents without a date
+    '''
+    if date is None:
+        return time.time()
+    return (date - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+class _LocalTier:
+    '''
+    SQLite copy of the facts read from or written to MongoDB, see the _local_cache_path option.
+    Rows are keyed by connection string and document _id, and record the date of the facts
+    and when they were last copied from MongoDB.
+    '''
+    def __init__(self, path, uri):
+        self._path = path
+        self._uri = uri or ''
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        # The facts may be sensitive, create the file before SQLite does with the umask permissions
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        with self._db() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS facts ('
+                       'uri TEXT, id TEXT, data BLOB, date REAL, fetched REAL, PRIMARY KEY (uri, id))')
+
+    @contextmanager
+    def _db(self):
+        # A connection per use, as refreshes run in other threads
+        db = sqlite3.connect(self._path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, doc_id):
+        '''
+        Returns the (facts, date, fetched) of a document, None when there is no copy
+        '''
+        with self._db() as db:
+            row = db.execute('SELECT data, date, fetched FROM facts WHERE uri = ? AND id = ?', (self._uri, doc_id)).fetchone()
+        if row is None:
+            return None
+        return bson.decode(row[0]), row[1], row[2]
+
+    def put(self, entries):
+        '''
+        Stores the (doc_id, facts, date) entries as just copied from MongoDB
+        '''
+        now = time.time()
+        with self._db() as db:
+            db.executemany('INSERT OR REPLACE INTO facts (uri, id, data, date, fetched) VALUES (?, ?, ?, ?, ?)',
+                           [(self._uri, doc_id, bson.encode(data), date, now) for doc_id, data, date in entries])
+
+    def refresh(self, entries):
+        '''
+        Stores the (doc_id, facts, date, since) entries read from MongoDB by a refresh which started at since,
+        unless the copy was written again meanwhile. No facts means the document is gone.
+        '''
+        now = time.time()
+        with self._db() as db:
+            for doc_id, data, date, since in entries:
+                if data is None:
+                    db.execute('DELETE FROM facts WHERE uri = ? AND id = ? AND fetched <= ?', (self._uri, doc_id, since))
+                else:
+                    db.execute('UPDATE facts SET data = ?, date = ?, fetched = ? WHERE uri = ? AND id = ? AND fetched <= ?',
+                               (bson.encode(data), date, now, self._uri, doc_id, since))
+
+    def delete(self, doc_id):
+        with self._db() as db:
+            db.execute('DELETE FROM facts WHERE uri = ? AND id = ?', (self._uri, doc_id))
+
+    def delete_prefix(self, prefix):
+        with self._db() as db:
+            db.execute('DELETE FROM facts WHERE uri = ? AND substr(id, 1, ?) = ?', (self._uri, len(prefix), prefix))
+
+
+def _fact_delta(old, new, path, sets, unsets):
+    '''
+    Fills sets and unsets with the $set and $unset fields turning old into new, two dicts stored at path
+    '''
+    for key in set(old) | set(new):
+        if not isinstance(key, str) or not key or '.' in key or key.startswith('$'):
+            # The key can not be addressed by a dotted path, replace the whole dict
+            sets[path] = new
+            return
+    for key, value in new.items():
+        key_path = '%s.%s' % (path, key)
+        if key not in old:
+            sets[key_path] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            _fact_delta(old[key], value, key_path, sets, unsets)
+        elif type(value) is not type(old[key]) or value != old[key]:
+            sets[key_path] = value
+    for key in old:
+        if key not in new:
+            unsets['%s.%s' % (path, key)] = ''
+
+
+# atexit handlers run last in first out, pending writes are flushed and refreshes
+# finished before the clients are closed
+atexit.register(_close_clients)
+atexit.register(_flush_write_behind)
+atexit.register(_stop_refreshes)
+
 
 class CacheModule(BaseCacheModule):
     """
@@ -78,60 +527,169 @@ class CacheModule(BaseCacheModule):
             self._connection = self.get_option('_uri')
             self._timeout = int(self.get_option('_timeout'))
             self._prefix = self.get_option('_prefix')
+            self._write_behind = self.get_option('_write_behind')
+            self._write_behind_size = self.get_option('_write_behind_size')
+            self._write_behind_interval = self.get_option('_write_behind_interval')
+            self._prefetch = self.get_option('_prefetch')
+            self._compression = self.get_option('_compression')
+            self._delta_updates = self.get_option('_delta_updates')
+            self._batch_size = self.get_option('_batch_size')
+            read_preference = self.get_option('_read_preference')
+            max_staleness = self.get_option('_max_staleness_seconds')
+            write_concern_w = self.get_option('_write_concern_w')
+            journal = self.get_option('_journal')
+            self._buckets = self.get_option('_buckets')
+            local_cache_path = self.get_option('_local_cache_path')
+            self._local_cache_max_age = self.get_option('_local_cache_max_age')
         except KeyError:
             self._connection = C.CACHE_PLUGIN_CONNECTION
             self._timeout = int(C.CACHE_PLUGIN_TIMEOUT)
             self._prefix = C.CACHE_PLUGIN_PREFIX
+            self._write_behind = False
+            self._write_behind_size = 100
+            self._write_behind_interval = 5
+            self._prefetch = False
+            self._compression = 'none'
+            self._delta_updates = False
+            self._batch_size = 1000
+            read_preference = max_staleness = write_concern_w = journal = None
+            self._buckets = 1
+            local_cache_path = None
+            self._local_cache_max_age = 300
+
+        self._read_preference = None
+        if read_preference is not None:
+            if read_preference == 'primary':
+                if max_staleness is not None:
+                    raise AnsibleError('The mongodb cache _max_staleness_seconds option can not be used with the primary read preference')
+                self._read_preference = pymongo.read_preferences.Primary()
+            else:
+                self._read_preference = _read_preferences[read_preference](max_staleness=-1 if max_staleness is None else max_staleness)
+        elif max_staleness is not None:
+            raise AnsibleError('The mongodb cache _max_staleness_seconds option requires the _read_preference option')
+
+        self._write_concern = None
+        if write_concern_w is not None or journal is not None:
+            if write_concern_w is not None and write_concern_w.isdigit():
+                write_concern_w = int(write_concern_w)
+            try:
+                self._write_concern = pymongo.write_concern.WriteConcern(w=write_concern_w, j=journal)
+            except pymongo.errors.ConfigurationError as excep:
+                raise AnsibleError('Invalid mongodb cache write concern: %s' % to_native(excep))
+            if self._delta_updates and not self._write_concern.acknowledged:
+                # A delta is only safe when it is known to have matched the stored document
+                raise AnsibleError('The mongodb cache _delta_updates option can not be used with unacknowledged writes')
 
+        if self._compression != 'none' and self._compression not in _codecs:
+            raise AnsibleError("The '%s' compression is not available with this version of Python" % self._compression)
         self._cache = {}
-        self._managed_indexes = False
+        # Buffered writes, host key -> (facts, date), and when the oldest of them was buffered
+        self._pending = {}
+        self._pending_since = None
+        if self._write_behind:
+            _write_behind_caches.add(self)
+        # Keys stored in the collection once prefetched, None until then
+        self._prefetched_keys = None
+        # Copy of the facts last read from or written to the collection, per host, see _delta_updates
+        self._stored = {}
+        self._local = None
+        if local_cache_path:
+            try:
+                self._local = _LocalTier(local_cache_path, self._connection)
+            except (OSError, sqlite3.Error) as excep:
+                raise AnsibleError('Unable to open the mongodb cache local copy %s: %s' % (local_cache_path, to_native(excep)))
 
-    def _ttl_index_exists(self, collection):
+    def _ttl_index(self, collection):
         '''
-        Returns true if an index named ttl exists
-        on the given collection.
+        Returns the index named ttl on the given collection,
+        None if there is no such index.
         '''
-        exists = False
         try:
-            indexes = collection.list_indexes()
-            for index in indexes:
+            for index in collection.list_indexes():
                 if index["name"] == "ttl":
-                    exists = True
-                    break
+                    return index
         except pymongo.errors.OperationFailure as excep:
             raise AnsibleError('Error checking MongoDB index: %s' % to_native(excep))
-        return exists
+        return None
 
     def _manage_indexes(self, collection):
         '''
-        This function manages indexes on the mongo collection.
-        We only do this once, at run time based on _managed_indexes,
-        rather than per connection instantiation as that would be overkill
+        This function reconciles the ttl index of the mongo collection with the _timeout option.
+        This is done once per process, collection and timeout rather than per plugin instance,
+        as __setstate__ builds a new instance in every worker. Forked workers inherit the marker
+        of the reconciliation done by the controller.
         '''
-        _timeout = self._timeout
-        if _timeout and _timeout > 0:
+        marker = (self._connection, collection.full_name, self._timeout)
+        while True:
+            with _indexes_lock:
+                if marker in _reconciled_indexes:
+                    return
+                reconciling = _reconciling_indexes.get(marker)
+                if reconciling is None:
+                    reconciling = _reconciling_indexes[marker] = threading.Event()
+                    break
+            # Reconciled by another thread, check again once it is done
+            reconciling.wait()
+        try:
+            _timeout = self._timeout
+            index = self._ttl_index(collection)
             try:
-                collection.create_index(
-                    'date',
-                    name='ttl',
-                    expireAfterSeconds=_timeout
-                )
-            except pymongo.errors.OperationFailure:
-                # We make it here when the fact_caching_timeout was set to a different value between runs
-                if self._ttl_index_exists(collection):
+                if _timeout and _timeout > 0:
+                    if index is not None and (dict(index['key']) != {'date': 1} or 'expireAfterSeconds' not in index):
+                        # Not an index collMod can turn into the one we need
+                        collection.drop_index('ttl')
+                        index = None
+                    if index is None:
+                        collection.create_index(
+                            'date',
+                            name='ttl',
+                            expireAfterSeconds=_timeout
+                        )
+                    elif index['expireAfterSeconds'] != _timeout:
+                        # We make it here when the fact_caching_timeout was set to a different value between runs.
+                        # collMod updates the expiry in place, dropping the index would rebuild it.
+                        collection.database.command(
+                            'collMod',
+                            collection.name,
+                            index={'name': 'ttl', 'expireAfterSeconds': _timeout}
+                        )
+                elif index is not None:
                     collection.drop_index('ttl')
-                return self._manage_indexes(collection)
-        else:
-            if self._ttl_index_exists(collection):
-                collection.drop_index('ttl')
+            except pymongo.errors.OperationFailure as excep:
+                raise AnsibleError('Error managing the MongoDB cache ttl index: %s' % to_native(excep))
+            with _indexes_lock:
+                _reconciled_indexes.add(marker)
+        finally:
+            with _indexes_lock:
+                _reconciling_indexes.pop(marker, None)
+            reconciling.set()
+
+    def _collection_names(self):
+        '''
+        Returns the names of every collection holding facts, see the _buckets option
+        '''
+        if self._buckets > 1:
+            return ['cache_%d' % bucket for bucket in range(self._buckets)]
+        # The collection is hard coded as ``cache``, there are no configuration options for this
+        return ['cache']
+
+    def _collection_name(self, key):
+        '''
+        Returns the name of the collection holding the facts of a host
+        '''
+        if self._buckets > 1:
+            # crc32 rather than hash(), which is salted differently in every process
+            return 'cache_%d' % (zlib.crc32(to_bytes(self._make_key(key))) % self._buckets)
+        return 'cache'
 
     @contextmanager
-    def _collection(self):
+    def _collection(self, name='cache'):
         '''
-        This is a context manager for opening and closing mongo connections as needed. This exists as to not create a global
-        connection, due to pymongo not being fork safe (https://www.mongodb.com/docs/languages/python/pymongo-driver/current/faq/#is-pymongo-fork-safe-)
+        This is a context manager returning a cache collection. The underlying client is pooled per process
+        and per connection string so every call of a play reuses the same connections. Clients are never shared
+        across a fork, due to pymongo not being fork safe (https://www.mongodb.com/docs/languages/python/pymongo-driver/current/faq/#is-pymongo-fork-safe-)
         '''
-        mongo = pymongo.MongoClient(self._connection)
+        mongo = _get_client(self._connection)
         try:
             db = mongo.get_default_database()
         except pymongo.errors.ConfigurationError:
@@ -139,68 +697,326 @@ class CacheModule(BaseCacheModule):
             # in the MongoDB Connection String URI
             db = mongo['ansible']
 
-        # The collection is hard coded as ``cache``, there are no configuration options for this
-        collection = db['cache']
-        if not self._managed_indexes:
-            # Only manage the indexes once per run, not per connection
-            self._manage_indexes(collection)
-            self._managed_indexes = True
+        collection = db.get_collection(
+            name,
+            read_preference=self._read_preference,
+            write_concern=self._write_concern
+        )
+        self._manage_indexes(collection)
 
         yield collection
 
-        mongo.close()
+    def _map_collections(self, func, names=None):
+        '''
+        Returns the results of func called with each cache collection, or the named ones, in order.
+        With several buckets the collections are processed concurrently.
+        '''
+        if names is None:
+            names = self._collection_names()
+
+        def run(name):
+            with self._collection(name) as collection:
+                return func(collection)
+
+        if len(names) == 1:
+            return [run(names[0])]
+        with ThreadPoolExecutor(max_workers=min(len(names), 8)) as executor:
+            return list(executor.map(run, names))
 
     def _make_key(self, key):
         return '%s%s' % (self._prefix, key)
 
+    def _prefix_filter(self):
+        '''
+        Returns the query matching every document stored with the configured prefix.
+        Every string starting with the prefix sorts between the prefix and the prefix with its last
+        character incremented, so this is a bounded scan of the _id index.
+        '''
+        if not self._prefix:
+            return {}
+        if ord(self._prefix[-1]) == sys.maxunicode:
+            return {'_id': {'$regex': '^%s' % re.escape(self._prefix)}}
+        return {'_id': {'$gte': self._prefix, '$lt': self._prefix[:-1] + chr(ord(self._prefix[-1]) + 1)}}
+
+    def _decode(self, doc):
+        '''
+        Returns the facts held by a cache document, decompressing them when stored with a codec
+        '''
+        data = doc.get('data', {})
+        codec = doc.get('codec')
+        if codec:
+            if codec not in _codecs:
+                raise AnsibleError("Unable to read the facts of '%s', the '%s' compression is not available" % (doc['_id'], codec))
+            data = bson.decode(_codecs[codec][1](data))
+        return data
+
+    def _remember(self, key, value):
+        '''
+        Records the facts currently stored for a host, the base of the next delta update
+        '''
+        if self._delta_updates and self._compression == 'none':
+            self._stored[key] = copy.deepcopy(value)
+
+    def _local_get(self, key):
+        '''
+        Returns the facts of a host from the local copy, None when there is no usable copy.
+        Copies older than _local_cache_max_age are refreshed from MongoDB in the background.
+        '''
+        try:
+            entry = self._local.get(self._make_key(key))
+        except sqlite3.Error as excep:
+            display.warning('Unable to read the mongodb cache local copy: %s' % to_native(excep))
+            return None
+        if entry is None:
+            return None
+        data, date, fetched = entry
+        now = time.time()
+        if self._timeout > 0 and date + self._timeout <= now:
+            # MongoDB expired these facts as well
+            return None
+        if now - fetched >= self._local_cache_max_age:
+            _refresher.add(self, key)
+        return data
+
+    def _local_put(self, entries):
+        try:
+            self._local.put(entries)
+        except sqlite3.Error as excep:
+            display.warning('Unable to update the mongodb cache local copy: %s' % to_native(excep))
+
+    def _refresh(self, entries):
+        '''
+        Updates the local copies of the facts of the (key, since) entries from MongoDB,
+        with one query per collection and _batch_size hosts
+        '''
+        doc_ids = {}
+        for key, since in entries:
+            doc_ids.setdefault(self._collection_name(key), []).append((self._make_key(key), since))
+        for name, batch in sorted(doc_ids.items()):
+            for start in range(0, len(batch), self._batch_size):
+                chunk = batch[start:start + self._batch_size]
+                try:
+                    with self._collection(name) as collection:
+                        docs = dict((doc['_id'], doc) for doc in collection.find(
+                            {'_id': {'$in': [doc_id for doc_id, since in chunk]}}, batch_size=self._batch_size))
+                    refreshed = []
+                    for doc_id, since in chunk:
+                        doc = docs.get(doc_id)
+                        if doc and 'data' in doc:
+                            refreshed.append((doc_id, self._decode(doc), _epoch(doc.get('date')), since))
+                        else:
+                            refreshed.append((doc_id, None, None, since))
+                    self._local.refresh(refreshed)
+                except Exception as excep:
+                    display.vvv('Unable to refresh the mongodb cache local copies of %d host(s): %s' % (len(chunk), to_native(excep)))
+
+    def _prefetch_all(self):
+        '''
+        Loads the facts of every host stored with the configured prefix with a single query
+        '''
+        prefetched_keys = set()
+        mirrored = []
+
+        def fetch(collection):
+            return list(collection.find(self._prefix_filter(), {'data': True, 'codec': True, 'date': True}, batch_size=self._batch_size))
+
+        for docs in self._map_collections(fetch):
+            for doc in docs:
+                key = doc['_id'][len(self._prefix):]
+                prefetched_keys.add(key)
+                # Facts set during this run are more recent than the stored ones
+                if key not in self._cache:
+                    self._cache[key] = self._decode(doc)
+                    self._remember(key, self._cache[key])
+                    if self._local is not None:
+                        mirrored.append((doc['_id'], self._cache[key], _epoch(doc.get('date'))))
+        self._prefetched_keys = prefetched_keys | set(self._pending)
+        if mirrored:
+            self._local_put(mirrored)
+
     def get(self, key):
+        if key not in self._cache and self._local is not None:
+            value = self._local_get(key)
+            if value is not None:
+                self._cache[key] = value
+        if key not in self._cache and self._prefetch and self._prefetched_keys is None:
+            self._prefetch_all()
+        if key not in self._cache and self._prefetched_keys is not None:
+            # Everything stored was prefetched, the host has no cached facts
+            self._cache[key] = {}
         if key not in self._cache:
-            with self._collection() as collection:
+            with self._collection(self._collection_name(key)) as collection:
                 value = collection.find_one({'_id': self._make_key(key)})
                 if value and 'data' in value:
-                    self._cache[key] = value['data']
+                    self._cache[key] = self._decode(value)
+                    self._remember(key, self._cache[key])
+                    if self._local is not None:
+                        self._local_put([(value['_id'], self._cache[key], _epoch(value.get('date')))])
                 else:
                     self._cache[key] = {}
 
         return self._cache.get(key)
 
+    def _update_spec(self, key, value, date, full=False):
+        '''
+        Returns the filter and update documents writing the facts of a host, and whether the update
+        is a delta. A delta must not be upserted, it only holds the changed facts of the stored document.
+        With full, the update sets all the facts whatever was stored before.
+        '''
+        update = {
+            '$set': {
+                '_id': self._make_key(key),
+                'data': value,
+                'date': date
+            }
+        }
+        stored = None if full else self._stored.get(key)
+        delta = self._compression == 'none' and isinstance(stored, dict) and isinstance(value, dict)
+        if delta:
+            sets = {}
+            unsets = {}
+            _fact_delta(stored, value, 'data', sets, unsets)
+            del update['$set']['data']
+            update['$set'].update(sets)
+            if unsets:
+                update['$unset'] = unsets
+        elif self._compression == 'none':
+            # The document may have been compressed by a previous run
+            update['$unset'] = {'codec': ''}
+        else:
+            compress = _codecs[self._compression][0]
+            update['$set']['data'] = bson.Binary(compress(bson.encode(value)))
+            update['$set']['codec'] = self._compression
+        return {'_id': self._make_key(key)}, update, delta
+
+    def _flush_pending(self):
+        '''
+        Sends the writes buffered by the _write_behind option as a single bulk write
+        '''
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = {}
+        self._pending_since = None
+        requests = {}
+        deltas = {}
+        for key, (value, date) in pending.items():
+            spec_filter, update, delta = self._update_spec(key, value, date)
+            requests.setdefault(self._collection_name(key), []).append(pymongo.UpdateOne(spec_filter, update, upsert=not delta))
+            if delta:
+                deltas.setdefault(self._collection_name(key), []).append(key)
+
+        def write(collection):
+            # There is a single request per host, so their order does not matter
+            result = collection.bulk_write(requests[collection.name], ordered=False)
+            # The counts of unacknowledged writes are unknown
+            if collection.name in deltas and result.acknowledged and \
+                    result.matched_count + result.upserted_count < len(requests[collection.name]):
+                # Documents removed since they were read, the unmatched hosts are unknown so every delta is sent in full
+                full_requests = []
+                for key in deltas[collection.name]:
+                    spec_filter, update, delta = self._update_spec(key, pending[key][0], pending[key][1], full=True)
+                    full_requests.append(pymongo.UpdateOne(spec_filter, update, upsert=True))
+                collection.bulk_write(full_requests, ordered=False)
+
+        try:
+            self._map_collections(write, names=sorted(requests))
+        except pymongo.errors.PyMongoError as excep:
+            # What was actually stored is unknown, the next write of these hosts must be a full one
+            for key in pending:
+                self._stored.pop(key, None)
+            raise AnsibleError('Error writing facts of %d host(s) to the MongoDB cache: %s' % (len(pending), to_native(excep)))
+        for key, (value, date) in pending.items():
+            self._remember(key, value)
+
     def set(self, key, value):
         self._cache[key] = value
-        with self._collection() as collection:
-            collection.update_one(
-                {'_id': self._make_key(key)},
-                {
-                    '$set': {
-                        '_id': self._make_key(key),
-                        'data': value,
-                        'date': datetime.datetime.utcnow()
-                    }
-                },
-                upsert=True
-            )
+        if self._prefetched_keys is not None:
+            self._prefetched_keys.add(key)
+        if self._local is not None:
+            self._local_put([(self._make_key(key), value, time.time())])
+        if self._write_behind:
+            self._pending[key] = (value, datetime.datetime.utcnow())
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            if len(self._pending) >= self._write_behind_size or \
+                    time.monotonic() - self._pending_since >= self._write_behind_interval:
+                self._flush_pending()
+            return
+        with self._collection(self._collection_name(key)) as collection:
+            date = datetime.datetime.utcnow()
+            try:
+                spec_filter, update, delta = self._update_spec(key, value, date)
+                result = collection.update_one(spec_filter, update, upsert=not delta)
+                if delta and result.acknowledged and not result.matched_count:
+                    # Removed since it was read, by the ttl monitor or another controller
+                    collection.update_one(*self._update_spec(key, value, date, full=True)[:2], upsert=True)
+            except pymongo.errors.PyMongoError:
+                self._stored.pop(key, None)
+                raise
+        self._remember(key, value)
 
     def keys(self):
-        with self._collection() as collection:
-            return [doc['_id'] for doc in collection.find({}, {'_id': True})]
+        self._flush_pending()
+
+        def fetch(collection):
+            return [doc['_id'][len(self._prefix):]
+                    for doc in collection.find(self._prefix_filter(), {'_id': True}, batch_size=self._batch_size)]
+
+        return [key for keys in self._map_collections(fetch) for key in keys]
 
     def contains(self, key):
-        with self._collection() as collection:
+        if key in self._pending:
+            return True
+        if self._local is not None and key not in self._cache:
+            value = self._local_get(key)
+            if value is not None:
+                self._cache[key] = value
+                return True
+        if self._prefetch and self._prefetched_keys is None:
+            self._prefetch_all()
+        if self._prefetched_keys is not None:
+            return key in self._prefetched_keys
+        with self._collection(self._collection_name(key)) as collection:
             return bool(collection.count_documents({'_id': self._make_key(key)}))
 
     def delete(self, key):
         del self._cache[key]
-        with self._collection() as collection:
+        # A buffered write must not resurrect the host once deleted
+        self._pending.pop(key, None)
+        if self._prefetched_keys is not None:
+            self._prefetched_keys.discard(key)
+        self._stored.pop(key, None)
+        if self._local is not None:
+            self._local.delete(self._make_key(key))
+        with self._collection(self._collection_name(key)) as collection:
             collection.delete_one({'_id': self._make_key(key)})
 
     def flush(self):
-        with self._collection() as collection:
-            collection.delete_many({})
+        self._pending = {}
+        self._pending_since = None
+        if self._prefetched_keys is not None:
+            self._prefetched_keys = set()
+        self._stored = {}
+        if self._local is not None:
+            self._local.delete_prefix(self._prefix)
+        self._map_collections(lambda collection: collection.delete_many(self._prefix_filter()))
 
     def copy(self):
-        with self._collection() as collection:
-            return dict((d['_id'], d['data']) for d in collection.find({}))
+        self._flush_pending()
+
+        def fetch(collection):
+            cursor = collection.find(self._prefix_filter(), {'data': True, 'codec': True}, batch_size=self._batch_size)
+            return dict((d['_id'][len(self._prefix):], self._decode(d)) for d in cursor)
+
+        facts = {}
+        for bucket in self._map_collections(fetch):
+            facts.update(bucket)
+        return facts
 
     def __getstate__(self):
+        # Workers rebuild the plugin from scratch, make the buffered facts visible to them first
+        self._flush_pending()
         return dict()
 
     def __setstate__(self, data):
@@ -46,4 +46,9 @@ options:
       - Authentication path intended for MongoDB Atlas Instances
     type: bool
     default: False
+notes:
+  - When the C(ANSIBLE_MONGODB_TOPOLOGY_CACHE_TTL) environment variable is set on the remote host, for example with the
+    C(environment) keyword, whether auth is enabled, the server version and the replica set name of I(login_host):I(login_port)
+    are cached for this number of seconds in a file private to the remote user. The following tasks skip the round trips of
+    the detection. The cached facts are dropped when authenticating fails, and probed again when auth turns out to be enabled.
 '''
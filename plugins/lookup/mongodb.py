@@ -28,6 +28,7 @@ version_added: "1.0.0"
 short_description: lookup info from MongoDB
 description:
     - 'The ``MongoDB`` lookup runs the *find()* command on a given *collection* on a given *MongoDB* server.'
+    - 'It runs an *aggregate()* pipeline instead when O(aggregate) is set.'
     - 'The result is a list of jsons, so slightly different from what PyMongo returns. In particular, *timestamps* are converted to epoch integers.'
 options:
     connect_string:
@@ -69,6 +70,119 @@ options:
         type: list
         elements: list
         default: []
+    operation:
+        description:
+            - V(find) returns the matching documents.
+            - V(count) returns the number of documents matching O(filter), O(skip) and O(limit) apply.
+            - V(estimated_count) returns the number of documents of the collection from its metadata, without a filter.
+            - V(distinct) returns the list of the distinct values of O(field) among the documents matching O(filter).
+            - The count and distinct operations run on the server and only send back the result, no cursor is transferred.
+        type: str
+        choices: [find, count, estimated_count, distinct]
+        default: find
+    field:
+        description:
+            - Name of the field, in dot notation, whose values are returned by O(operation=distinct).
+        type: str
+    aggregate:
+        description:
+            - Aggregation pipeline to run on the server instead of a find.
+            - Each stage is a dict, exactly as given to pymongo's aggregate. Only the documents returned by the last stage are sent back.
+            - O(filter), O(projection), O(sort), O(skip) and O(limit) cannot be used with a pipeline, use C($match), C($project), C($sort),
+              C($skip) and C($limit) stages instead.
+        type: list
+        elements: dict
+    allow_disk_use:
+        description:
+            - Let the stages of the O(aggregate) pipeline write temporary files when they exceed the server memory limit.
+        type: bool
+    max_time_ms:
+        description:
+            - Server side time limit, in milliseconds, of the query, pipeline or O(operation).
+        type: integer
+    hint:
+        description:
+            - Index the query, pipeline or count must use, either its name or its key pattern.
+            - The key pattern is a list of C([field, direction]) pairs, where the direction is C(ASCENDING) or C(DESCENDING) as in O(sort),
+              or the C(1) or C(-1) of the index key pattern.
+        type: raw
+    comment:
+        description:
+            - Comment attached to the query, shown in the profiler, the server logs and C(currentOp).
+        type: str
+    output:
+        description:
+            - Format of the returned documents.
+            - V(epoch) returns each document as a dict, with datetimes converted to the number of seconds since the epoch and the other
+              values that are not JSON, such as ObjectId, converted to strings.
+            - V(iso8601) returns each document as a dict, with datetimes converted to ISO 8601 strings in UTC such as C(2020-07-26T12:30:15Z).
+              ObjectId, Decimal128 and UUID values are strings, binary values are base64 strings, or UUID strings for binary subtype 4,
+              and timestamps are dicts with their C(t) time and C(i) increment.
+            - V(canonical_extjson) returns each document as a dict in canonical Extended JSON, so every value keeps its BSON type,
+              for example a datetime is a C($date) dict and a Decimal128 a C($numberDecimal) dict.
+            - V(raw_extjson) returns each document as a string of Relaxed Extended JSON, as written by C(bson.json_util). The BSON types
+              are kept, for example to pass the documents as they are to another module or to write them to a file.
+            - V(epoch), V(iso8601) and V(canonical_extjson) also apply to the values returned by O(operation=distinct).
+              V(raw_extjson) only applies to the documents of a find or O(aggregate) pipeline.
+        type: str
+        choices: [epoch, iso8601, canonical_extjson, raw_extjson]
+        default: epoch
+    explain:
+        description:
+            - Return how the server runs the query or O(aggregate) pipeline instead of the documents.
+            - The result is a single dict with the C(winningPlan) of the query planner and the C(executionStats) of the query,
+              for example to check an index is used instead of a C(COLLSCAN).
+            - Cannot be used with an O(operation) other than V(find).
+        type: bool
+        default: false
+    batch_size:
+        description:
+            - Number of documents fetched from the server per round trip.
+            - Documents are converted as they are read from the cursor, so this also bounds the number of raw documents held in memory.
+        type: integer
+    max_documents:
+        description:
+            - Fail the lookup when the query returns more than this number of documents.
+            - Guards the controller against a query matching far more documents than expected.
+            - Cannot be used with an O(aggregate) pipeline ending in a C($out) or C($merge) stage, which returns no documents.
+        type: integer
+    max_bytes:
+        description:
+            - Fail the lookup when the BSON size of the returned documents exceeds this number of bytes.
+            - The documents are then read as raw BSON, so their size is known without encoding them again on the controller.
+        type: integer
+    cache:
+        description:
+            - Memoize the result of each term, so identical terms looked up again return the stored result instead of querying the server.
+            - Terms are identical when every key and value, including the connection string, the filter, projection, sort, skip and limit,
+              and the order of the keys, are the same.
+            - This is set as a keyword of the lookup, for example C(lookup('community.mongodb.mongodb', params, cache=true)), not in the term.
+            - The results are stored as JSON files in a directory of the temp dir only readable by the current user, so they are
+              shared by the workers Ansible forks for each task and host. Nothing is memoized when this directory is not private.
+            - Results of any term are stored, including the documents of a query, use O(cache_max_entries) to bound the files kept.
+        type: bool
+        default: false
+    cache_ttl:
+        description:
+            - Number of seconds a memoized result is returned before the term is queried again.
+            - Keyword of the lookup, see O(cache).
+        type: float
+        default: 60
+    cache_max_entries:
+        description:
+            - Maximum number of memoized results, the least recently used results are dropped first.
+            - The bound applies to all the memoized results of the user, whatever the lookup that stored them.
+            - Keyword of the lookup, see O(cache).
+        type: integer
+        default: 128
+    parallel:
+        description:
+            - Maximum number of terms looked up at the same time, each on its own thread.
+            - The results are returned in the order of the terms whatever the order the queries complete in.
+            - When a term fails the lookup fails, the error names the index of the term, its database and collection.
+            - Keyword of the lookup, for example C(query('community.mongodb.mongodb', shard1, shard2, shard3, parallel=3)).
+        type: integer
+        default: 1
     extra_connection_parameters:
         description:
             - Extra connection parameters that to be sent to pymongo.MongoClient
@@ -77,6 +191,8 @@ options:
         type: dict
         default: {}
 notes:
+    - "Clients are pooled per controller process, connection string and O(extra_connection_parameters). Every term and lookup
+      using the same connection reuses the same client, which is closed when the process exits."
     - "Please check https://pymongo.readthedocs.io/en/stable/api/pymongo/collection.html#pymongo.collection.Collection.find for more details."
 requirements:
     - pymongo >= 2.4 (python library)
@@ -142,6 +258,27 @@ EXAMPLES = '''
           collection: "startup_log"
           connection_string: "mongodb://localhost/"
 
+    - name: "Count the startups per hostname on the server, only the counts are returned"
+      debug: msg="{{ item._id }} started {{ item.count }} times"
+      with_mongodb:
+        - database: 'local'
+          collection: "startup_log"
+          connection_string: "mongodb://localhost/"
+          aggregate:
+            - { "$group": { "_id": "$hostname", "count": { "$sum": 1 } } }
+            - { "$sort": { "count": -1 } }
+          allow_disk_use: true
+          max_time_ms: 10000
+
+    - name: "Number of startups and distinct hostnames, without transferring the documents"
+      debug: msg="{{ query('mongodb', startups, startups | combine({'operation': 'distinct', 'field': 'hostname'})) }}"
+      vars:
+        startups:
+          database: 'local'
+          collection: "startup_log"
+          connection_string: "mongodb://localhost/"
+          operation: count
+
 
 '''
 
@@ -152,13 +289,35 @@ RETURN = """
     type: list
 """
 
+import atexit
+import base64
 import datetime
-
-from ansible.module_utils.common.text.converters import to_native
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible.module_utils.common.text.converters import to_bytes, to_native
+from ansible.module_utils.parsing.convert_bool import boolean
 from ansible.errors import AnsibleError
 from ansible.plugins.lookup import LookupBase
+from ansible_collections.community.mongodb.plugins.module_utils.mongodb_common import private_dir
 
 try:
+    import bson
+    from bson import json_util
+    from bson.binary import Binary, UuidRepresentation
+    from bson.decimal128 import Decimal128
+    from bson.objectid import ObjectId
+    from bson.raw_bson import RawBSONDocument
+    from bson.timestamp import Timestamp
+    from bson.son import SON
     from pymongo import ASCENDING, DESCENDING
     from pymongo.errors import ConnectionFailure
     from pymongo import MongoClient
@@ -172,6 +331,242 @@ except ImportError:
 else:
     pymongo_found = True
 
+# MongoClient instances shared by every lookup of this process, keyed by (pid, connection string, parameters)
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(connection_string, extra_connection_parameters):
+    '''
+    Returns the client for the connection string and parameters, creating it on first use.
+    Clients inherited from a parent process are discarded rather than reused, as pymongo is not fork safe.
+    '''
+    pid = os.getpid()
+    key = (pid, connection_string, json.dumps(extra_connection_parameters, sort_keys=True, default=str))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            for stale in [k for k in _clients if k[0] != pid]:
+                # Never close a client from another process, its sockets belong to the parent
+                del _clients[stale]
+            client = MongoClient(connection_string, **extra_connection_parameters)
+            _clients[key] = client
+    return client
+
+
+def _close_clients():
+    pid = os.getpid()
+    with _clients_lock:
+        for key in [k for k in _clients if k[0] == pid]:
+            _clients.pop(key).close()
+
+
+atexit.register(_close_clients)
+
+_operations = (u"find", u"count", u"estimated_count", u"distinct")
+_outputs = (u"epoch", u"iso8601", u"canonical_extjson", u"raw_extjson")
+
+# Memoized results are shared by the workers forked by Ansible, one file per term in a private directory of the user,
+# see the cache option
+_RESULTS_DIR = 'ansible-mongodb-lookup'
+
+
+def _term_digest(term):
+    # Key order is kept, an embedded document in a filter only matches with its fields in the same order
+    return hashlib.sha256(to_bytes(json.dumps(term, default=str))).hexdigest()
+
+
+def _remove_result(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _touch_result(path):
+    # The modification time is the last use, set from the clock as file times may be coarser
+    now = time.time()
+    try:
+        os.utime(path, (now, now))
+    except OSError:
+        pass
+
+
+def _get_cached_result(digest):
+    directory = private_dir(_RESULTS_DIR)
+    if directory is None:
+        return None
+    path = os.path.join(directory, digest + '.json')
+    try:
+        with open(path) as result_file:
+            entry = json.load(result_file)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or entry.get('expires', 0) <= time.time():
+        _remove_result(path)
+        return None
+    _touch_result(path)
+    return entry.get('result')
+
+
+def _set_cached_result(digest, result, ttl, max_entries):
+    if ttl <= 0 or max_entries <= 0:
+        return
+    directory = private_dir(_RESULTS_DIR)
+    if directory is None:
+        return
+    path = os.path.join(directory, digest + '.json')
+    tmp_path = None
+    try:
+        # Written aside and renamed, the other workers never read a partial result
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as result_file:
+            json.dump({'expires': time.time() + ttl, 'result': result}, result_file)
+        os.rename(tmp_path, path)
+    except (IOError, OSError, TypeError, ValueError):
+        if tmp_path is not None:
+            _remove_result(tmp_path)
+        return
+    _touch_result(path)
+
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            try:
+                entries.append((os.stat(os.path.join(directory, name)).st_mtime, name))
+            except OSError:
+                pass
+    # Least recently used first
+    entries.sort()
+    for dummy, name in entries[:max(len(entries) - max_entries, 0)]:
+        _remove_result(os.path.join(directory, name))
+
+
+# Types returned as they are, checked on the exact type first as it is by far the most common case
+_json_native = frozenset([type(None), bool, int, float, str])
+
+
+def _epoch(value):
+    return (value - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+def _iso8601(value):
+    # The driver returns naive datetimes in UTC unless the client is tz_aware
+    if value.tzinfo is not None:
+        value = value.astimezone(_utc).replace(tzinfo=None)
+    return value.isoformat() + u"Z"
+
+
+def _binary_iso8601(value):
+    if value.subtype == 4:
+        return u"{0}".format(value.as_uuid())
+    return to_native(base64.b64encode(value))
+
+
+def _timestamp_iso8601(value):
+    return {u"t": value.time, u"i": value.inc}
+
+
+_utc = datetime.timezone.utc
+
+# Converters of the non JSON types found in the documents for each output, looked up on the exact type of the value
+_codecs = {}
+if pymongo_found:
+    _codecs[u"epoch"] = {
+        datetime.datetime: _epoch,
+        ObjectId: str,
+        Decimal128: str,
+        Binary: str,
+        uuid.UUID: str,
+        Timestamp: str,
+    }
+    _codecs[u"iso8601"] = {
+        datetime.datetime: _iso8601,
+        ObjectId: str,
+        # The string keeps every digit, unlike a float
+        Decimal128: str,
+        Binary: _binary_iso8601,
+        # The driver decodes binary subtype 0 to bytes
+        bytes: lambda value: to_native(base64.b64encode(value)),
+        uuid.UUID: str,
+        Timestamp: _timestamp_iso8601,
+    }
+    # Native UUIDs are only returned by clients configured with a uuidRepresentation, write them as standard binary UUIDs
+    _canonical_json_options = json_util.JSONOptions(json_mode=json_util.JSONMode.CANONICAL,
+                                                    uuid_representation=UuidRepresentation.STANDARD)
+    _relaxed_json_options = json_util.JSONOptions(json_mode=json_util.JSONMode.RELAXED,
+                                                  uuid_representation=UuidRepresentation.STANDARD)
+
+
+def _dumps_relaxed(document):
+    return json_util.dumps(document, json_options=_relaxed_json_options)
+
+
+def _convert_value(value, converters):
+    converter = converters.get(type(value))
+    if converter is not None:
+        return converter(value)
+    # Subclasses and unknown types
+    if value is None or isinstance(value, (int, float, bool, str)):
+        return value
+    if isinstance(value, datetime.datetime):
+        return converters[datetime.datetime](value)
+    # failsafe
+    return u"{0}".format(value)
+
+
+class _Frame(object):
+    '''
+    A container being converted. It is only copied once one of its values changes,
+    so JSON native subtrees are returned as they are.
+    '''
+    __slots__ = ('source', 'keys', 'key', 'result')
+
+    def __init__(self, source, key=None):
+        self.source = source
+        self.key = key
+        if isinstance(source, list):
+            self.keys = iter(range(len(source)))
+            # Subclasses are always turned into a plain list or dict
+            self.result = source if type(source) is list else list(source)
+        else:
+            self.keys = iter(list(source.keys()))
+            self.result = source if type(source) is dict else dict(source)
+
+    def set(self, key, value):
+        if self.result is self.source:
+            self.result = list(self.source) if type(self.source) is list else dict(self.source)
+        self.result[key] = value
+
+
+def _convert_document(document, converters):
+    '''
+    Depth first conversion with an explicit stack, replacing the values that are not JSON native.
+    '''
+    if type(document) in _json_native:
+        return document
+    if not isinstance(document, (list, dict)):
+        return _convert_value(document, converters)
+
+    stack = [_Frame(document)]
+    while True:
+        frame = stack[-1]
+        source = frame.source
+        for key in frame.keys:
+            value = source[key]
+            if type(value) in _json_native:
+                continue
+            if isinstance(value, (list, dict)):
+                stack.append(_Frame(value, key))
+                break
+            frame.set(key, _convert_value(value, converters))
+        else:
+            stack.pop()
+            if not stack:
+                return frame.result
+            if frame.result is not source:
+                stack[-1].set(frame.key, frame.result)
+
 
 class LookupModule(LookupBase):
 
@@ -182,87 +577,261 @@ class LookupModule(LookupBase):
         if not isinstance(sort_parameter, list):
             raise AnsibleError(u"Error. Sort parameters must be a list, not [ {0} ]".format(sort_parameter))
 
+        # Leave the sort of the caller's term untouched
+        sort_parameter = [list(item) for item in sort_parameter]
         for item in sort_parameter:
             self._convert_sort_string_to_constant(item)
 
         return sort_parameter
 
     def _convert_sort_string_to_constant(self, item):
-        original_sort_order = item[1]
-        sort_order = original_sort_order.upper()
+        if not isinstance(item[1], str):
+            # Already a direction such as 1 or -1
+            return
+        sort_order = item[1].upper()
         if sort_order == u"ASCENDING":
             item[1] = ASCENDING
         elif sort_order == u"DESCENDING":
             item[1] = DESCENDING
         # else the user knows what s/he is doing and we won't predict. PyMongo will return an error if necessary
 
-    def convert_mongo_result_to_valid_json(self, result):
-        if result is None:
-            return result
-        if isinstance(result, (int, float, bool)):
-            return result
-        if isinstance(result, str):
-            return result
-        elif isinstance(result, list):
-            new_list = []
-            for elem in result:
-                new_list.append(self.convert_mongo_result_to_valid_json(elem))
-            return new_list
-        elif isinstance(result, dict):
-            new_dict = {}
-            for key in result.keys():
-                value = result[key]  # python2 and 3 compatible....
-                new_dict[key] = self.convert_mongo_result_to_valid_json(value)
-            return new_dict
-        elif isinstance(result, datetime.datetime):
-            # epoch
-            return (result - datetime.datetime(1970, 1, 1)). total_seconds()
+    def convert_mongo_result_to_valid_json(self, result, output=u"epoch"):
+        if output == u"canonical_extjson":
+            return json.loads(json_util.dumps(result, json_options=_canonical_json_options))
+        return _convert_document(result, _codecs[output])
+
+    def _read_cursor(self, cursor, max_documents=None, max_bytes=None, convert=None, codec_options=None):
+        '''
+        Converts the documents one at a time as they are read from the cursor, so only the current
+        batch of raw documents is held in memory, and enforces the size caps of the term.
+        Raw BSON documents are measured by the length of their bytes, then decoded with codec_options.
+        '''
+        if convert is None:
+            convert = self.convert_mongo_result_to_valid_json
+        documents = 0
+        size = 0
+        try:
+            for result in cursor:
+                documents += 1
+                if max_documents is not None and documents > max_documents:
+                    raise AnsibleError(u"the query returned more than max_documents={0} documents".format(max_documents))
+                if max_bytes is not None:
+                    if isinstance(result, RawBSONDocument):
+                        size += len(result.raw)
+                        result = bson.decode(result.raw, codec_options=codec_options)
+                    else:
+                        size += len(bson.encode(result))
+                    if size > max_bytes:
+                        raise AnsibleError(u"the query returned more than max_bytes={0} bytes".format(max_bytes))
+                yield convert(result)
+        finally:
+            close = getattr(cursor, 'close', None)
+            if close is not None:
+                # Release the server side cursor when a cap stops the iteration early
+                close()
+
+    def _aggregate_options(self, pipeline, term):
+        if not isinstance(pipeline, list):
+            raise AnsibleError(u"Error. aggregate must be a list of pipeline stages, not [ {0} ]".format(pipeline))
+        for option in [u"filter", u"projection", u"sort", u"skip", u"limit"]:
+            if option in term:
+                raise AnsibleError(u"Error. {0} cannot be used with aggregate, use a pipeline stage instead".format(option))
+
+        options = {}
+        for option, name in [(u"allow_disk_use", "allowDiskUse"), (u"batch_size", "batchSize"), (u"max_time_ms", "maxTimeMS")]:
+            if option in term:
+                options[name] = term.pop(option)
+        # all other parameters are sent to mongo, as for find
+        options.update(term)
+        return options
+
+    def _aggregate(self, collection, pipeline, term, max_documents=None):
+        options = self._aggregate_options(pipeline, term)
+
+        if max_documents is not None:
+            if pipeline and isinstance(pipeline[-1], dict) and (u"$out" in pipeline[-1] or u"$merge" in pipeline[-1]):
+                # A $limit can not follow these stages, and before them it would silently truncate what is written
+                raise AnsibleError(u"Error. max_documents cannot be used with a pipeline ending in $out or $merge")
+            # One extra document is enough to tell the cap was exceeded
+            pipeline = pipeline + [{u"$limit": max_documents + 1}]
+        return collection.aggregate(pipeline, **options)
+
+    def _explain(self, collection, pipeline, term):
+        '''
+        Returns the winning plan and the execution stats of the find or pipeline, instead of its documents.
+        '''
+        if pipeline is None:
+            # allPlansExecution verbosity, the execution stats are included
+            explain = collection.find(**term).explain()
         else:
-            # failsafe
-            return u"{0}".format(result)
+            command = {u"aggregate": collection.name, u"pipeline": pipeline, u"cursor": {}}
+            options = self._aggregate_options(pipeline, term)
+            options.pop("batchSize", None)
+            if isinstance(options.get("hint"), list):
+                # A raw command takes the key pattern as a document
+                options["hint"] = SON([tuple(item) for item in options["hint"]])
+            command.update(options)
+            explain = collection.database.command({u"explain": command, u"verbosity": u"executionStats"})
+
+        stats = explain
+        if u"queryPlanner" not in explain and explain.get(u"stages"):
+            # A pipeline that is not entirely pushed down to the query layer reports the plan in its first stage
+            stats = explain[u"stages"][0].get(u"$cursor", {})
+        return self.convert_mongo_result_to_valid_json({
+            u"winningPlan": stats.get(u"queryPlanner", {}).get(u"winningPlan"),
+            u"executionStats": stats.get(u"executionStats"),
+        })
+
+    def _run_operation(self, collection, operation, term, output=u"epoch"):
+        '''
+        Runs a count or distinct, the server only sends back the scalar or the list of distinct values.
+        '''
+        if u"max_time_ms" in term:
+            term[u"maxTimeMS"] = term.pop(u"max_time_ms")
+
+        if operation == u"estimated_count":
+            if u"filter" in term:
+                raise AnsibleError(u"Error. estimated_count counts the whole collection, use operation count with a filter")
+            return [collection.estimated_document_count(**term)]
+
+        query_filter = term.pop(u"filter", {})
+        if operation == u"count":
+            return [collection.count_documents(query_filter, **term)]
+
+        if u"field" not in term:
+            raise AnsibleError(u"missing mandatory parameter [field] for operation distinct")
+        field = term.pop(u"field")
+        # The distinct values are returned as a single list, so several terms are not merged together
+        return [self.convert_mongo_result_to_valid_json(collection.distinct(field, query_filter, **term), output)]
 
     def run(self, terms, variables, **kwargs):
         try:
-            return self._run_helper(terms)
+            return self._run_helper(terms,
+                                    cache=boolean(kwargs.get('cache', False), strict=False),
+                                    cache_ttl=float(kwargs.get('cache_ttl', 60)),
+                                    cache_max_entries=int(kwargs.get('cache_max_entries', 128)),
+                                    parallel=int(kwargs.get('parallel', 1)))
         except Exception as e:
             print(u"There was an exception on the mongodb_lookup: {0}".format(to_native(e)))
             raise e
 
-    def _run_helper(self, terms):
+    def _run_helper(self, terms, cache=False, cache_ttl=60, cache_max_entries=128, parallel=1):
         if not pymongo_found:
             raise AnsibleError(u"pymongo is required in the control node (this machine) for mongodb lookup.")
-        ret = []
-        for term in terms:
-            for required_parameter in [u"database", u"collection"]:
-                if required_parameter not in term:
-                    raise AnsibleError(u"missing mandatory parameter [{0}]".format(required_parameter))
-
-            connection_string = term.get(u'connection_string', u"mongodb://localhost")
-            database = term[u"database"]
-            collection = term[u'collection']
-            extra_connection_parameters = term.get(u'extra_connection_parameters', {})
-
-            if u"extra_connection_parameters" in term:
-                del term[u"extra_connection_parameters"]
-            if u"connection_string" in term:
-                del term[u"connection_string"]
-            del term[u"database"]
-            del term[u"collection"]
 
-            if u"sort" in term:
-                term[u"sort"] = self._fix_sort_parameter(term[u"sort"])
+        def lookup(term):
+            if not cache:
+                return self._run_term(term)
+            digest = _term_digest(term)
+            result = _get_cached_result(digest)
+            if result is None:
+                result = self._run_term(term)
+                _set_cached_result(digest, result, cache_ttl, cache_max_entries)
+            return result
 
-            # all other parameters are sent to mongo, so we are future and past proof
+        ret = []
+        if parallel <= 1 or len(terms) < 2:
+            for term in terms:
+                ret.extend(lookup(term))
+            return ret
+
+        with ThreadPoolExecutor(max_workers=min(parallel, len(terms))) as executor:
+            futures = [executor.submit(lookup, term) for term in terms]
+            # Results are gathered in the order of the terms, whatever the order the queries complete in
+            for index, (term, future) in enumerate(zip(terms, futures)):
+                try:
+                    ret.extend(future.result())
+                except Exception as e:
+                    for pending in futures:
+                        pending.cancel()
+                    raise AnsibleError(u"term {0} ({1}) failed: {2}".format(index, self._describe_term(term), to_native(e)))
+        return ret
 
+    def _describe_term(self, term):
+        if not isinstance(term, dict):
+            return u"not a dict"
+        return u"{0}.{1}".format(term.get(u"database"), term.get(u"collection"))
+
+    def _run_term(self, term):
+        # The term may be reused by the caller, work on a copy
+        term = dict(term)
+        for required_parameter in [u"database", u"collection"]:
+            if required_parameter not in term:
+                raise AnsibleError(u"missing mandatory parameter [{0}]".format(required_parameter))
+
+        connection_string = term.get(u'connection_string', u"mongodb://localhost")
+        database = term[u"database"]
+        collection = term[u'collection']
+        extra_connection_parameters = term.get(u'extra_connection_parameters', {})
+
+        if u"extra_connection_parameters" in term:
+            del term[u"extra_connection_parameters"]
+        if u"connection_string" in term:
+            del term[u"connection_string"]
+        del term[u"database"]
+        del term[u"collection"]
+
+        max_documents = term.pop(u"max_documents", None)
+        max_bytes = term.pop(u"max_bytes", None)
+        pipeline = term.pop(u"aggregate", None)
+        operation = term.pop(u"operation", u"find")
+        explain = boolean(term.pop(u"explain", False), strict=False)
+        output = term.pop(u"output", u"epoch")
+
+        if output not in _outputs:
+            raise AnsibleError(u"Error. output must be one of {0}, not [ {1} ]".format(u", ".join(_outputs), output))
+        if output == u"raw_extjson" and (explain or operation != u"find"):
+            raise AnsibleError(u"Error. output raw_extjson is only supported when returning documents")
+
+        if isinstance(term.get(u"hint"), list):
+            term[u"hint"] = self._fix_sort_parameter(term[u"hint"])
+
+        if operation not in _operations:
+            raise AnsibleError(u"Error. operation must be one of {0}, not [ {1} ]".format(u", ".join(_operations), operation))
+        if operation != u"find":
+            if explain:
+                raise AnsibleError(u"Error. explain cannot be used with operation {0}".format(operation))
+            if pipeline is not None:
+                raise AnsibleError(u"Error. aggregate cannot be used with operation {0}".format(operation))
+            for option in [u"projection", u"sort", u"batch_size"]:
+                if option in term:
+                    raise AnsibleError(u"Error. {0} cannot be used with operation {1}".format(option, operation))
             try:
-                client = MongoClient(connection_string, **extra_connection_parameters)
-                results = client[database][collection].find(**term)
-
-                for result in results:
-                    result = self.convert_mongo_result_to_valid_json(result)
-                    ret.append(result)
-
+                client = _get_client(connection_string, extra_connection_parameters)
+                return self._run_operation(client[database][collection], operation, term, output)
             except ConnectionFailure as e:
                 raise AnsibleError(u'unable to connect to database: %s' % str(e))
 
-        return ret
+        if pipeline is None:
+            if u"sort" in term:
+                term[u"sort"] = self._fix_sort_parameter(term[u"sort"])
+            if max_documents is not None and not term.get(u"limit"):
+                # One extra document is enough to tell the cap was exceeded
+                term[u"limit"] = max_documents + 1
+
+        # all other parameters are sent to mongo, so we are future and past proof
+
+        try:
+            client = _get_client(connection_string, extra_connection_parameters)
+            if explain:
+                return [self._explain(client[database][collection], pipeline, term)]
+
+            if output == u"raw_extjson":
+                # The documents are written out by json_util in a single pass
+                convert = _dumps_relaxed
+            else:
+                convert = functools.partial(self.convert_mongo_result_to_valid_json, output=output)
+            mongo_collection = client[database][collection]
+            codec_options = None
+            if max_bytes is not None:
+                # Read raw BSON, the size of each document is known without encoding it again
+                codec_options = mongo_collection.codec_options
+                mongo_collection = mongo_collection.with_options(codec_options=codec_options.with_options(document_class=RawBSONDocument))
+            if pipeline is None:
+                results = mongo_collection.find(**term)
+            else:
+                results = self._aggregate(mongo_collection, pipeline, term, max_documents)
+            return list(self._read_cursor(results, max_documents, max_bytes, convert, codec_options))
+
+        except ConnectionFailure as e:
+            raise AnsibleError(u'unable to connect to database: %s' % str(e))
@@ -0,0 +1,271 @@
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import hashlib
+import json
+import os
+import select
+import socket
+import struct
+import threading
+import time
+import traceback
+
+from ansible_collections.community.mongodb.plugins.module_utils.mongodb_common import private_dir
+
+# pymongo and bson are imported by the functions using them, mongodb_user imports this file
+# whether the broker is enabled or not, and checks pymongo itself.
+
+# Environment variable enabling the broker, its value is the idle time to live of the broker in seconds
+BROKER_TTL_ENV = 'ANSIBLE_MONGODB_BROKER_TTL'
+
+_HEADER = struct.Struct('<i')
+
+
+def broker_idle_ttl():
+    """
+    Returns the idle time to live of the brokers from the environment, 0 when the broker is disabled
+    """
+    try:
+        return max(0, int(os.environ.get(BROKER_TTL_ENV, 0)))
+    except ValueError:
+        return 0
+
+
+def broker_dir():
+    """
+    Returns the directory of the broker sockets of the current user, creating it 0700.
+    None when it exists but is not a private directory of the current user.
+    """
+    return private_dir('ansible-mongodb-broker')
+
+
+def broker_socket_path(connection_params, directory=None):
+    """
+    Returns the path of the socket of the broker for the connection params.
+    The name is a digest of every param, credentials included, so a broker
+    is only reached with the exact same connection.
+    """
+    directory = directory or broker_dir()
+    if directory is None:
+        return None
+    digest = hashlib.sha256(json.dumps(connection_params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return os.path.join(directory, digest[:40] + '.sock')
+
+
+def _send(sock, document):
+    import bson
+
+    data = bson.encode(document)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    from pymongo.errors import ConnectionFailure
+
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionFailure('The mongodb broker closed the connection')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv(sock):
+    import bson
+    from bson.son import SON
+
+    size = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))[0]
+    return bson.decode(_recv_exactly(sock, size), codec_options=bson.CodecOptions(document_class=SON))
+
+
+class BrokerDatabase(object):
+    """
+    Stand in for a pymongo Database with only the command method
+    """
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def command(self, command, value=1, **kwargs):
+        from bson.son import SON
+
+        if isinstance(command, str):
+            command = SON([(command, value)])
+        command = SON(command)
+        command.update(kwargs)
+        return self.client._request(self.name, command)
+
+
+class BrokerClient(object):
+    """
+    Stand in for a MongoClient sending database commands through a broker.
+    Only client[db_name].command() is supported, modules using any other part
+    of the pymongo API must use a MongoClient.
+    """
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except Exception:
+            self.sock.close()
+            raise
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        return BrokerDatabase(self, name)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return BrokerDatabase(self, name)
+
+    def _request(self, db_name, command):
+        from pymongo.errors import OperationFailure
+
+        with self._lock:
+            _send(self.sock, {'db': db_name, 'command': command})
+            reply = _recv(self.sock)
+        if not reply['ok']:
+            raise OperationFailure(reply['errmsg'], reply.get('code'), reply.get('details'))
+        return reply['reply']
+
+    def close(self):
+        self.sock.close()
+
+
+def connect_broker(connection_params, directory=None):
+    """
+    Returns a BrokerClient to the running broker of the connection params, None when there is none
+    """
+    path = broker_socket_path(connection_params, directory)
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        client = BrokerClient(path)
+        client['admin'].command('ping')
+        return client
+    except Exception:
+        return None
+
+
+class Broker(object):
+    """
+    Serves the commands received on a UNIX socket with one pooled MongoClient,
+    until no command was received for idle_ttl seconds.
+    """
+    def __init__(self, path, connection_params, idle_ttl):
+        self.path = path
+        self.connection_params = connection_params
+        self.idle_ttl = idle_ttl
+        self.last_activity = time.time()
+        self.client = None
+
+    def _handle(self, conn):
+        from pymongo.errors import OperationFailure
+
+        try:
+            if not self._same_user(conn):
+                return
+            while True:
+                try:
+                    request = _recv(conn)
+                except Exception:
+                    return
+                self.last_activity = time.time()
+                try:
+                    reply = {'ok': 1, 'reply': self.client[request['db']].command(request['command'])}
+                except OperationFailure as excep:
+                    reply = {'ok': 0, 'errmsg': str(excep), 'code': excep.code, 'details': excep.details}
+                except Exception as excep:
+                    reply = {'ok': 0, 'errmsg': str(excep)}
+                _send(conn, reply)
+                self.last_activity = time.time()
+        finally:
+            conn.close()
+
+    def _same_user(self, conn):
+        # The socket is only reachable by the user, double check the peer where the platform allows it
+        if not hasattr(socket, 'SO_PEERCRED'):
+            return True
+        creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        return struct.unpack('3i', creds)[1] == os.getuid()
+
+    def serve(self):
+        import pymongo
+
+        self.client = pymongo.MongoClient(**self.connection_params)
+        # Authenticates, a broker with wrong credentials never listens
+        self.client['admin'].command('ping')
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            listener.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        listener.listen(16)
+        try:
+            while time.time() - self.last_activity < self.idle_ttl:
+                readable = select.select([listener], [], [], 1)[0]
+                if readable:
+                    conn = listener.accept()[0]
+                    self.last_activity = time.time()
+                    thread = threading.Thread(target=self._handle, args=(conn,))
+                    thread.daemon = True
+                    thread.start()
+        finally:
+            listener.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.client.close()
+
+
+def start_broker(connection_params, idle_ttl, directory=None):
+    """
+    Starts a detached broker for the connection params, unless one is already running.
+    Returns True when a broker was started. Failures are silent, the modules keep
+    connecting directly. The broker checks the credentials before listening.
+    It must be called before the module builds a MongoClient: pymongo is not fork safe,
+    nothing is started while other threads, such as its monitors, are running.
+    """
+    path = broker_socket_path(connection_params, directory)
+    if path is None or threading.active_count() > 1:
+        return False
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            return False
+        except socket.error:
+            # Left by a broker that did not exit cleanly
+            os.unlink(path)
+        finally:
+            probe.close()
+    try:
+        pid = os.fork()
+    except OSError:
+        return False
+    if pid:
+        os.waitpid(pid, 0)
+        return True
+
+    # First child, detach from the module so Ansible does not wait for the broker
+    try:
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        Broker(path, connection_params, idle_ttl).serve()
+    except Exception:
+        traceback.print_exc()
+    finally:
+        os._exit(0)
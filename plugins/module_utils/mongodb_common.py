@@ -1,42 +1,83 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
-import configparser
 
 from ansible.module_utils.basic import missing_required_lib  # pylint: disable=unused-import:
 from ansible.module_utils.common.text.converters import to_native
 import traceback
+import json
 import os
-import ssl as ssl_lib
-
-
-try:
-    from bson.timestamp import Timestamp
-    from bson import ObjectId
-except ImportError:
-    pass  # TODO Should we do something here or are we covered by pymongo?
-
-MongoClient = None
-PYMONGO_IMP_ERR = None
-pymongo_found = None
-PyMongoVersion = None
-ConnectionFailure = None
-OperationFailure = None
-TYPES_NEED_TO_CONVERT = None
-
-try:
-    from pymongo.errors import ConnectionFailure  # pylint: disable=unused-import:
-    from pymongo.errors import OperationFailure  # pylint: disable=unused-import:
-    from pymongo import version as PyMongoVersion
-    from pymongo import MongoClient
-    pymongo_found = True
-except ImportError:
-    PYMONGO_IMP_ERR = traceback.format_exc()
-    pymongo_found = False
-
-try:
-    TYPES_NEED_TO_CONVERT = (Timestamp, ObjectId)
-except NameError:
-    pass  # sanity tests
+import stat
+import sys
+import tempfile
+import time
+
+# pymongo and bson take about half of the import time of mongodb_common, they are only
+# imported once one of these names is used or check_pymongo is called, see _load_pymongo
+_PYMONGO_NAMES = (
+    'MongoClient',
+    'PYMONGO_IMP_ERR',
+    'pymongo_found',
+    'PyMongoVersion',
+    'ConnectionFailure',
+    'OperationFailure',
+    'TYPES_NEED_TO_CONVERT',
+    'Timestamp',
+    'ObjectId',
+)
+
+
+def _load_pymongo():
+    """
+    Imports pymongo and bson and sets the names of _PYMONGO_NAMES, once.
+    Names already set, for example by the unit tests, are kept.
+    Returns the module globals, the functions of this file read the names from them.
+    """
+    module_globals = globals()
+    if 'pymongo_found' in module_globals:
+        return module_globals
+    names = dict.fromkeys(_PYMONGO_NAMES)
+    try:
+        from bson.timestamp import Timestamp
+        from bson import ObjectId
+        names.update(Timestamp=Timestamp, ObjectId=ObjectId, TYPES_NEED_TO_CONVERT=(Timestamp, ObjectId))
+    except ImportError:
+        pass  # TODO Should we do something here or are we covered by pymongo?
+    try:
+        from pymongo.errors import ConnectionFailure
+        from pymongo.errors import OperationFailure
+        from pymongo import version as PyMongoVersion
+        from pymongo import MongoClient
+        names.update(ConnectionFailure=ConnectionFailure, OperationFailure=OperationFailure,
+                     PyMongoVersion=PyMongoVersion, MongoClient=MongoClient, pymongo_found=True)
+    except ImportError:
+        names.update(PYMONGO_IMP_ERR=traceback.format_exc(), pymongo_found=False)
+    for name, value in names.items():
+        module_globals.setdefault(name, value)
+    return module_globals
+
+
+def __getattr__(name):
+    # Module attribute fallback (PEP 562), reached for the pymongo names until they are loaded
+    if name in _PYMONGO_NAMES:
+        _load_pymongo()
+        return globals()[name]
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+
+if sys.version_info < (3, 7):
+    # No module __getattr__, import eagerly
+    _load_pymongo()
+
+
+def check_pymongo(module):
+    """
+    Imports pymongo, failing the module when it is not installed.
+    Modules call it first thing in main, rather than importing pymongo_found with the module.
+    """
+    pymongo_names = _load_pymongo()
+    if not pymongo_names['pymongo_found']:
+        module.fail_json(msg=missing_required_lib('pymongo'),
+                         exception=pymongo_names['PYMONGO_IMP_ERR'])
 
 
 def check_compatibility(module, srv_version, driver_version):
@@ -54,6 +95,8 @@ def check_compatibility(module, srv_version, driver_version):
 
 
 def load_mongocnf():
+    import configparser
+
     config = configparser.RawConfigParser()
     mongocnf = os.path.expanduser('~/.mongodb.cnf')
 
@@ -168,7 +211,9 @@ def rename_ssl_option_for_pymongo4(connection_options):
     This function renames the old ssl parameter, and sorts the data out,
     when the driver use is >= PyMongo 4
     """
-    if int(PyMongoVersion[0]) >= 4:
+    import ssl as ssl_lib
+
+    if int(_load_pymongo()['PyMongoVersion'][0]) >= 4:
         if connection_options.get('ssl_cert_reqs', None) in ('CERT_NONE', ssl_lib.CERT_NONE):
             connection_options['tlsAllowInvalidCertificates'] = True
         elif connection_options.get('ssl_cert_reqs', None) in ('CERT_REQUIRED', ssl_lib.CERT_REQUIRED):
@@ -202,6 +247,8 @@ def add_option_if_not_none(param_name, module, connection_params):
 
 
 def ssl_connection_options(connection_params, module):
+    import ssl as ssl_lib
+
     connection_params['ssl'] = True
     if module.params['ssl_cert_reqs'] is not None:
         connection_params['ssl_cert_reqs'] = getattr(ssl_lib, module.params['ssl_cert_reqs'])
@@ -236,7 +283,7 @@ def check_srv_version(module, client):
 def check_driver_compatibility(module, client, srv_version):
     try:
         # Get driver version::
-        driver_version = PyMongoVersion
+        driver_version = _load_pymongo()['PyMongoVersion']
         # Check driver and server version compatibility:
         check_compatibility(module, srv_version, driver_version)
     except Exception as excep:
@@ -247,6 +294,15 @@ def get_mongodb_client(module, login_user=None, login_password=None, login_datab
     """
     Build the connection params dict and returns a MongoDB Client object
     """
+    connection_params = get_mongodb_connection_params(module, login_user, login_password, login_database, directConnection)
+    client = _load_pymongo()['MongoClient'](**connection_params)
+    return client
+
+
+def get_mongodb_connection_params(module, login_user=None, login_password=None, login_database=None, directConnection=False):
+    """
+    Returns the MongoClient keyword arguments for the module params and credentials
+    """
     connection_params = {
         'host': module.params['login_host'],
         'port': module.params['login_port'],
@@ -267,22 +323,40 @@ def get_mongodb_client(module, login_user=None, login_password=None, login_datab
         connection_params['username'] = login_user
         connection_params['password'] = login_password
         connection_params['authSource'] = login_database
-    client = MongoClient(**connection_params)
-    return client
+    return connection_params
 
 
-def is_auth_enabled(module):
+def is_auth_enabled(module, client=None):
     """
     Returns True if auth is enabled on the mongo instance
     For PyMongo 4+ we have to connect directly to the instance
     rather than the replicaset
+    @client - Optional client directly connected to the instance, used instead of a new one
     """
-    auth_is_enabled = None
+    return probe_server(module, client, version=False)['auth_enabled']
+
+
+def probe_server(module, client=None, version=True):
+    """
+    Returns a dict with the hello reply of the instance, its server version and
+    whether auth is enabled on it, gathered with a single connection.
+    When client is given it must be directly connected to the instance, it is
+    used as is and left open. Otherwise a direct client is built and closed.
+    @version - Also ask the server version, only sent when auth is disabled, as the
+    client probing is then the one used. Otherwise the version is None.
+    """
+    cached = get_cached_topology(module)
+    if cached is not None:
+        return cached
+    if client is not None:
+        return _set_cached_topology(module, _probe_server(module, client, version))
+
+    pymongo_names = _load_pymongo()
     connection_params = {}
     connection_params['host'] = module.params['login_host']
     connection_params['port'] = module.params['login_port']
     connection_params['directConnection'] = True  # Need to do this for 3.12.* as well
-    if int(PyMongoVersion[0]) >= 4:  # we need to connect directly to the instance
+    if int(pymongo_names['PyMongoVersion'][0]) >= 4:  # we need to connect directly to the instance
         connection_params['directConnection'] = True
     else:
         if 'replica_set' in module.params and module.params['replica_set'] is not None:
@@ -290,22 +364,142 @@ def is_auth_enabled(module):
     if module.params['ssl']:
         connection_params = ssl_connection_options(connection_params, module)
         connection_params = rename_ssl_option_for_pymongo4(connection_params)
+    myclient = pymongo_names['MongoClient'](**connection_params)
     try:
-        myclient = MongoClient(**connection_params)
-        hello_response = myclient.admin.command('hello')
-        if 'arbiterOnly' in hello_response and hello_response['arbiterOnly']:
-            auth_is_enabled = False  # Arbiters cannot login with a user
+        return _set_cached_topology(module, _probe_server(module, myclient, version))
+    finally:
+        myclient.close()
+
+
+def _probe_server(module, client, version=True):
+    probe = {'auth_enabled': None, 'hello': None, 'version': None, 'set_name': None}
+    try:
+        probe['hello'] = client.admin.command('hello')
+        probe['set_name'] = probe['hello'].get('setName')
+        if 'arbiterOnly' in probe['hello'] and probe['hello']['arbiterOnly']:
+            probe['auth_enabled'] = False  # Arbiters cannot login with a user
         else:
-            myclient['admin'].command('listDatabases', 1.0)
-            auth_is_enabled = False
+            client['admin'].command('listDatabases', 1.0, nameOnly=True)
+            probe['auth_enabled'] = False
+        if version:
+            probe['version'] = client.admin.command('buildInfo')['version']
     except Exception as excep:
         if hasattr(excep, 'code') and excep.code in [13]:
-            auth_is_enabled = True
-        if auth_is_enabled is None:  # if this is still none we have a problem
+            probe['auth_enabled'] = True
+        if probe['auth_enabled'] is None:  # if this is still none we have a problem
             module.fail_json(msg='Unable to determine if auth is enabled: {0}'.format(traceback.format_exc()))
-    finally:
-        myclient.close()
-    return auth_is_enabled
+    return probe
+
+
+# Environment variable enabling the topology cache, its value is the time to live of the cached facts in seconds
+TOPOLOGY_CACHE_TTL_ENV = 'ANSIBLE_MONGODB_TOPOLOGY_CACHE_TTL'
+
+
+def topology_cache_ttl():
+    """
+    Returns the time to live of the topology cache from the environment, 0 when the cache is disabled
+    """
+    try:
+        return max(0, int(os.environ.get(TOPOLOGY_CACHE_TTL_ENV, 0)))
+    except ValueError:
+        return 0
+
+
+def private_dir(name):
+    """
+    Returns the path of the directory name, suffixed with the uid of the current user,
+    in the temp dir, creating it 0700. None when it exists but is not a private
+    directory of the current user.
+    """
+    path = os.path.join(tempfile.gettempdir(), '%s-%d' % (name, os.getuid()))
+    try:
+        os.mkdir(path, 0o700)
+    except OSError:
+        pass
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        return None
+    return path
+
+
+def topology_cache_path():
+    """
+    Returns the path of the topology cache file of the current user, None when its directory is not private
+    """
+    directory = private_dir('ansible-mongodb-facts')
+    if directory is None:
+        return None
+    return os.path.join(directory, 'topology.json')
+
+
+def _topology_cache_key(module):
+    return '{0}:{1}'.format(module.params['login_host'], module.params['login_port'])
+
+
+def _read_topology_cache(path):
+    try:
+        with open(path) as cache_file:
+            entries = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return {}
+    return entries if isinstance(entries, dict) else {}
+
+
+def _write_topology_cache(path, entries):
+    # Written aside and renamed, concurrent module runs never read a partial file
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump(entries, cache_file)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+def get_cached_topology(module):
+    """
+    Returns the probe_server facts cached for login_host:login_port, without the hello reply.
+    None when the cache is disabled, the facts are missing or older than the time to live.
+    """
+    ttl = topology_cache_ttl()
+    path = topology_cache_path() if ttl else None
+    if path is None:
+        return None
+    entry = _read_topology_cache(path).get(_topology_cache_key(module))
+    if not isinstance(entry, dict) or not 0 <= time.time() - entry.get('time', 0) < ttl:
+        return None
+    return {'auth_enabled': entry.get('auth_enabled'), 'hello': None,
+            'version': entry.get('version'), 'set_name': entry.get('set_name')}
+
+
+def _set_cached_topology(module, probe):
+    ttl = topology_cache_ttl()
+    path = topology_cache_path() if ttl else None
+    if path is not None and probe['auth_enabled'] is not None and probe['version'] is not None:
+        entries = _read_topology_cache(path)
+        now = time.time()
+        # Drop the expired facts of other hosts, the file does not grow forever
+        entries = dict((key, entry) for key, entry in entries.items()
+                       if isinstance(entry, dict) and now - entry.get('time', 0) < ttl)
+        entries[_topology_cache_key(module)] = {'auth_enabled': probe['auth_enabled'], 'version': probe['version'],
+                                                'set_name': probe['set_name'], 'time': now}
+        _write_topology_cache(path, entries)
+    return probe
+
+
+def invalidate_cached_topology(module):
+    """
+    Removes the facts cached for login_host:login_port, for example after an authentication error
+    """
+    path = topology_cache_path() if topology_cache_ttl() else None
+    if path is None:
+        return
+    entries = _read_topology_cache(path)
+    if entries.pop(_topology_cache_key(module), None) is not None:
+        _write_topology_cache(path, entries)
 
 
 def mongo_auth(module, client, directConnection=False):
@@ -338,18 +532,49 @@ def mongo_auth(module, client, directConnection=False):
             fail_msg = "When supplying login arguments, both 'login_user' and 'login_password' must be provided"
 
         if 'create_for_localhost_exception' not in module.params and fail_msg is None:
+            probe = None
             try:
-                if is_auth_enabled(module):
+                # A direct client already reaches the instance to probe, no need for another connection.
+                # The version is only asked by the probe when its client is the one returned.
+                probe = probe_server(module, client if directConnection else None, version=directConnection)
+                checked = False
+                if probe['hello'] is None and not probe['auth_enabled']:
+                    # Cached facts, auth may have been enabled since, for example by the mongodb_auth role
+                    try:
+                        client['admin'].command('listDatabases', 1.0, nameOnly=True)
+                        checked = True
+                    except Exception as excep:
+                        if getattr(excep, 'code', None) != 13:
+                            raise
+                        invalidate_cached_topology(module)
+                        probe = probe_server(module, client if directConnection else None, version=directConnection)
+                if probe['auth_enabled']:
                     if login_user is not None and login_password is not None:
+                        if client is not None:
+                            # Replaced by the authenticated client
+                            client.close()
                         client = get_mongodb_client(module, login_user, login_password, login_database, directConnection=directConnection)
                     else:
                         fail_msg = 'No credentials to authenticate'
+                if fail_msg is None and not checked and (probe['auth_enabled'] or probe['version'] is None):
+                    # The returned client was not used by the probe, buildInfo checks its credentials and connection
+                    # and gets the version
+                    probe['version'] = client['admin'].command('buildInfo')['version']
+                    if probe['hello'] is not None:
+                        _set_cached_topology(module, probe)
             except Exception as excep:
+                if getattr(excep, 'code', None) in (13, 18):
+                    # Unauthorized or AuthenticationFailed, the cached facts may be stale
+                    invalidate_cached_topology(module)
                 fail_msg = 'unable to connect to database: %s' % to_native(excep)
             # Get server version:
             if fail_msg is None:
-                srv_version = check_srv_version(module, client)
+                # buildInfo was sent once, by the probe or on the returned client
+                srv_version = probe['version'] if probe['version'] is not None else check_srv_version(module, client)
                 check_driver_compatibility(module, client, srv_version)
+            elif probe is not None and probe['hello'] is None:
+                # The cached facts may be stale, the next run probes the server again
+                invalidate_cached_topology(module)
         elif fail_msg is None:  # this is the mongodb_user module
             if login_user is not None and login_password is not None:
                 client = get_mongodb_client(module, login_user, login_password, login_database, directConnection=directConnection)
@@ -463,9 +688,10 @@ def convert_to_supported(val):
         val (any) -- Any value fetched from database.
     Returns value of appropriate type.
     """
-    if isinstance(val, Timestamp):
+    pymongo_names = _load_pymongo()
+    if isinstance(val, pymongo_names['Timestamp']):
         return str(val)
-    elif isinstance(val, ObjectId):
+    elif isinstance(val, pymongo_names['ObjectId']):
         return str(val)
 
     return val  # By default returns the same value
@@ -476,13 +702,39 @@ def convert_bson_values_recur(mydict):
     Converts values that Ansible doesn't like
     # https://github.com/ansible-collections/community.mongodb/issues/462
     """
+    types_need_to_convert = _load_pymongo()['TYPES_NEED_TO_CONVERT']
     if isinstance(mydict, dict):
         for key, value in mydict.items():
             if isinstance(value, dict):
                 mydict[key] = convert_bson_values_recur(value)
             else:
-                if isinstance(value, TYPES_NEED_TO_CONVERT):
+                if isinstance(value, types_need_to_convert):
                     mydict[key] = convert_to_supported(value)
                 else:
                     mydict[key] = value
     return mydict
+
+
+def run_commands(client, commands, max_workers=4):
+    """
+    Runs independent database commands, at most max_workers at a time, over the connection pool of client.
+    Only use it for commands that do not depend on each other, they run in no particular order.
+    @client - The MongoDB connection object
+    @commands - List of (db_name, command) pairs, command being a dict or SON
+    @max_workers - Maximum number of commands in flight
+    Returns a list of (result, exception) pairs in the order of commands,
+    exception is None when the command succeeded and result None when it failed.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def run_command(db_command):
+        try:
+            return client[db_command[0]].command(db_command[1]), None
+        except Exception as excep:
+            return None, excep
+
+    commands = list(commands)
+    if max_workers < 2 or len(commands) < 2:
+        return [run_command(db_command) for db_command in commands]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(commands))) as executor:
+        return list(executor.map(run_command, commands))
@@ -146,11 +146,9 @@ import time
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.common.text.converters import to_native
 from ansible_collections.community.mongodb.plugins.module_utils.mongodb_common import (
-    missing_required_lib,
+    check_pymongo,
     mongodb_common_argument_spec,
     mongo_auth,
-    PYMONGO_IMP_ERR,
-    pymongo_found,
     get_mongodb_client,
 )
 
@@ -314,9 +312,7 @@ def main():
     if not has_ordereddict:
         module.fail_json(msg='Cannot import OrderedDict class. You can probably install with: pip install ordereddict')
 
-    if not pymongo_found:
-        module.fail_json(msg=missing_required_lib('pymongo'),
-                         exception=PYMONGO_IMP_ERR)
+    check_pymongo(module)
 
     login_host = module.params['login_host']
     login_port = module.params['login_port']
@@ -259,10 +259,8 @@ failed:
 
 from ansible.module_utils.basic import AnsibleModule
 from ansible_collections.community.mongodb.plugins.module_utils.mongodb_common import (
-    missing_required_lib,
+    check_pymongo,
     mongodb_common_argument_spec,
-    PYMONGO_IMP_ERR,
-    pymongo_found,
     index_exists,
     create_index,
     drop_index,
@@ -327,9 +325,7 @@ def main():
         required_together=[['login_user', 'login_password']],
     )
 
-    if not pymongo_found:
-        module.fail_json(msg=missing_required_lib('pymongo'),
-                         exception=PYMONGO_IMP_ERR)
+    check_pymongo(module)
 
     validate_module(module)
 
@@ -106,13 +106,12 @@ from uuid import UUID
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.common.text.converters import to_native
 from ansible_collections.community.mongodb.plugins.module_utils.mongodb_common import (
+    check_pymongo,
     convert_bson_values_recur,
     get_mongodb_client,
-    missing_required_lib,
     mongodb_common_argument_spec,
     mongo_auth,
-    PYMONGO_IMP_ERR,
-    pymongo_found,
+    run_commands,
 )
 
 
@@ -188,25 +187,34 @@ class MongoDbInfo():
         # Gather info about databases and their total size:
         self.info['databases'], self.info['total_size'] = self.get_db_info()
 
-        for dbname, val in self.info['databases'].items():
-            # Gather info about users for each database:
-            self.info['users'].update(self.get_users_info(dbname))
-
-            # Gather info about roles for each database:
-            self.info['roles'].update(self.get_roles_info(dbname))
+        # Gather info about users and roles for each database, the commands are independent and run concurrently:
+        commands = []
+        for dbname in self.info['databases']:
+            commands.append((dbname, {'usersInfo': 1}))
+            commands.append((dbname, {'rolesInfo': 1, 'showBuiltinRoles': True}))
+        results = run_commands(self.client, commands)
+        for (dbname, command), (result, excep) in zip(commands, results):
+            if excep is not None:
+                raise excep
+            if 'usersInfo' in command:
+                self.info['users'].update(self.get_users_info(dbname, result))
+            else:
+                self.info['roles'].update(self.get_roles_info(dbname, result))
 
         self.info = convert_bson_values_recur(self.info)
 
-    def get_roles_info(self, dbname):
+    def get_roles_info(self, dbname, reply=None):
         """Gather information about roles.
 
         Args:
             dbname (str): Database name to get role info from.
+            reply (dict): Reply of the rolesInfo command when already run.
 
         Returns a dictionary with role information for the given db.
         """
-        db = self.client[dbname]
-        result = db.command({'rolesInfo': 1, 'showBuiltinRoles': True})['roles']
+        if reply is None:
+            reply = self.client[dbname].command({'rolesInfo': 1, 'showBuiltinRoles': True})
+        result = reply['roles']
 
         roles_dict = {}
         for elem in result:
@@ -219,16 +227,18 @@ class MongoDbInfo():
 
         return {dbname: roles_dict}
 
-    def get_users_info(self, dbname):
+    def get_users_info(self, dbname, reply=None):
         """Gather information about users.
 
         Args:
             dbname (str): Database name to get user info from.
+            reply (dict): Reply of the usersInfo command when already run.
 
         Returns a dictionary with user information for the given db.
         """
-        db = self.client[dbname]
-        result = db.command({'usersInfo': 1})['users']
+        if reply is None:
+            reply = self.client[dbname].command({'usersInfo': 1})
+        result = reply['users']
 
         users_dict = {}
         for elem in result:
@@ -289,9 +299,7 @@ def main():
         required_together=[['login_user', 'login_password']],
     )
 
-    if not pymongo_found:
-        module.fail_json(msg=missing_required_lib('pymongo'),
-                         exception=PYMONGO_IMP_ERR)
+    check_pymongo(module)
 
     filter_ = module.params['filter']
 
@@ -64,12 +64,10 @@ failed:
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.common.text.converters import to_native
 from ansible_collections.community.mongodb.plugins.module_utils.mongodb_common import (
-    missing_required_lib,
+    check_pymongo,
     mongodb_common_argument_spec,
     member_state,
     mongo_auth,
-    PYMONGO_IMP_ERR,
-    pymongo_found,
     get_mongodb_client,
 )
 
@@ -93,9 +91,7 @@ def main():
         required_together=[['login_user', 'login_password']],
     )
 
-    if not pymongo_found:
-        module.fail_json(msg=missing_required_lib('pymongo'),
-                         exception=PYMONGO_IMP_ERR)
+    check_pymongo(module)
 
     maintenance = module.params['maintenance']
 
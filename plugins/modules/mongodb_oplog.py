@@ -78,12 +78,10 @@ failed:
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.common.text.converters import to_native
 from ansible_collections.community.mongodb.plugins.module_utils.mongodb_common import (
-    missing_required_lib,
+    check_pymongo,
     mongodb_common_argument_spec,
     member_state,
     mongo_auth,
-    PYMONGO_IMP_ERR,
-    pymongo_found,
     get_mongodb_client,
 )
 
@@ -130,9 +128,7 @@ def main():
     if not has_ordereddict:
         module.fail_json(msg='Cannot import OrderedDict class. You can probably install with: pip install ordereddict')
 
-    if not pymongo_found:
-        module.fail_json(msg=missing_required_lib('pymongo'),
-                         exception=PYMONGO_IMP_ERR)
+    check_pymongo(module)
 
     oplog_size_mb = float(module.params['oplog_size_mb'])  # MongoDB 4.4 inists on a real
     compact = module.params['compact']
@@ -74,14 +74,12 @@ after:
 
 import traceback
 
-from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.common.text.converters import to_native
 from ansible_collections.community.mongodb.plugins.module_utils.mongodb_common import (
-    missing_required_lib,
+    check_pymongo,
     mongodb_common_argument_spec,
     mongo_auth,
-    PYMONGO_IMP_ERR,
-    pymongo_found,
     OperationFailure,
     get_mongodb_client,
 )
@@ -105,9 +103,7 @@ def main():
         required_together=[['login_user', 'login_password']],
     )
 
-    if not pymongo_found:
-        module.fail_json(msg=missing_required_lib('pymongo'),
-                         exception=PYMONGO_IMP_ERR)
+    check_pymongo(module)
 
     param = module.params['param']
     param_type = module.params['param_type']
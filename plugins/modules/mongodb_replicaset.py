@@ -291,13 +291,11 @@ reconfigure:
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.common.text.converters import to_native
 from ansible_collections.community.mongodb.plugins.module_utils.mongodb_common import (
-    missing_required_lib,
+    check_pymongo,
     mongodb_common_argument_spec,
     mongo_auth,
     member_dicts_different,
     lists_are_different,
-    PYMONGO_IMP_ERR,
-    pymongo_found,
     get_mongodb_client,
 )
 
@@ -538,9 +536,7 @@ def main():
         required_together=[['login_user', 'login_password']],
     )
 
-    if not pymongo_found:
-        module.fail_json(msg=missing_required_lib('pymongo'),
-                         exception=PYMONGO_IMP_ERR)
+    check_pymongo(module)
 
     replica_set = module.params['replica_set']
     members = module.params['members']
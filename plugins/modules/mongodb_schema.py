@@ -159,11 +159,9 @@ module_config:
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.common.text.converters import to_native
 from ansible_collections.community.mongodb.plugins.module_utils.mongodb_common import (
-    missing_required_lib,
+    check_pymongo,
     mongodb_common_argument_spec,
     mongo_auth,
-    PYMONGO_IMP_ERR,
-    pymongo_found,
     get_mongodb_client,
 )
 import json
@@ -269,9 +267,7 @@ def main():
     if not has_ordereddict:
         module.fail_json(msg='Cannot import OrderedDict class. You can probably install with: pip install ordereddict')
 
-    if not pymongo_found:
-        module.fail_json(msg=missing_required_lib('pymongo'),
-                         exception=PYMONGO_IMP_ERR)
+    check_pymongo(module)
 
     db = module.params['db']
     collection = module.params['collection']
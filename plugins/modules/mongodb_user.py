@@ -96,6 +96,10 @@ notes:
     - Requires the pymongo Python package on the remote host, version 4+. This
       can be installed using pip or the OS package manager. Newer mongo server versions require newer
       pymongo versions. @see https://www.mongodb.com/docs/languages/python/pymongo-driver/current/compatibility/
+    - When the C(ANSIBLE_MONGODB_BROKER_TTL) environment variable is set on the remote host, for example with the C(environment)
+      keyword, and I(login_user) and I(login_password) are given, the module leaves a broker process behind holding the
+      authenticated connection. The next runs with the same connection send their commands through its UNIX socket, private to
+      the remote user, instead of connecting and authenticating again. The broker exits after this number of seconds without commands.
 requirements:
   - "pymongo"
 author:
@@ -221,15 +225,19 @@ import os
 import traceback
 
 
-from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.common.text.converters import to_native, to_bytes
 from ansible_collections.community.mongodb.plugins.module_utils.mongodb_common import (
-    missing_required_lib,
+    check_pymongo,
     mongodb_common_argument_spec,
     mongo_auth,
-    PYMONGO_IMP_ERR,
-    pymongo_found,
     get_mongodb_client,
+    get_mongodb_connection_params,
+)
+from ansible_collections.community.mongodb.plugins.module_utils.mongodb_broker import (
+    broker_idle_ttl,
+    connect_broker,
+    start_broker,
 )
 
 
@@ -402,9 +410,7 @@ def main():
     if module.params['login_database'] == '$external':
         module.params['update_password'] = 'on_create'
 
-    if not pymongo_found:
-        module.fail_json(msg=missing_required_lib('pymongo'),
-                         exception=PYMONGO_IMP_ERR)
+    check_pymongo(module)
 
     create_for_localhost_exception = module.params['create_for_localhost_exception']
     b_create_for_localhost_exception = (
@@ -420,14 +426,27 @@ def main():
     state = module.params['state']
     update_password = module.params['update_password']
 
-    try:
-        directConnection = False
-        if module.params['replica_set'] is None:
-            directConnection = True
-        client = get_mongodb_client(module, directConnection=directConnection)
-        client = mongo_auth(module, client, directConnection=directConnection)
-    except Exception as e:
-        module.fail_json(msg='Unable to connect to database: %s' % to_native(e))
+    directConnection = False
+    if module.params['replica_set'] is None:
+        directConnection = True
+
+    client = None
+    broker_params = None
+    broker_ttl = broker_idle_ttl()
+    if broker_ttl and login_user is not None and module.params['login_password'] is not None and create_for_localhost_exception is None:
+        broker_params = get_mongodb_connection_params(module, login_user, module.params['login_password'],
+                                                      module.params['login_database'], directConnection)
+        client = connect_broker(broker_params)
+        if client is None:
+            # For the next runs. Started before this run connects, a process with the pymongo threads must not fork
+            start_broker(broker_params, broker_ttl)
+
+    if client is None:
+        try:
+            client = get_mongodb_client(module, directConnection=directConnection)
+            client = mongo_auth(module, client, directConnection=directConnection)
+        except Exception as e:
+            module.fail_json(msg='Unable to connect to database: %s' % to_native(e))
 
     if state == 'present':
         if password is None and update_password == 'always':
@@ -3,8 +3,14 @@ from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
 import unittest
+import shutil
+import stat
+import subprocess
 import sys
 import os
+import tempfile
+import threading
+import time
 
 path = os.path.dirname(os.path.realpath(__file__))
 path = "{0}/../../plugins/module_utils".format(path)
@@ -55,6 +61,56 @@ class FakeAnsibleModule:
         return self.warning
 
 
+class FakeMongoServer:
+    """
+    Counts the clients built and the commands sent to an instance with auth enabled.
+    """
+    def __init__(self, auth_enabled=True, password='secret'):
+        self.auth_enabled = auth_enabled
+        self.password = password
+        self.clients = []
+        self.commands = []
+
+    def MongoClient(self, **kwargs):
+        server = self
+
+        class FakeDatabase:
+            def command(self, name, *args, **kwargs):
+                server.commands.append(name)
+                if client.kwargs.get('username') and client.kwargs.get('password') != server.password:
+                    # Authenticating on the first command fails
+                    raise mongodb_common.OperationFailure('Authentication failed.', code=18)
+                if name == 'ping':
+                    return {'ok': 1}
+                if name == 'hello':
+                    return {'isWritablePrimary': True}
+                if name == 'buildInfo':
+                    return {'version': '7.0.2'}
+                if server.auth_enabled and not client.kwargs.get('username'):
+                    raise mongodb_common.OperationFailure('command %s requires authentication' % name, code=13)
+                return {'ok': 1}
+
+        class FakeClient:
+            admin = FakeDatabase()
+
+            def __init__(self):
+                self.kwargs = kwargs
+                self.closed = False
+
+            def __getitem__(self, name):
+                return self.admin
+
+            def server_info(self):
+                return self.admin.command('buildInfo')
+
+            def close(self):
+                self.closed = True
+
+        client = FakeClient()
+        self.clients.append(client)
+        return client
+
+
 class TestMongoDBCommonMethods(unittest.TestCase):
     member_config_defaults = {
         "arbiterOnly": False,
@@ -514,6 +570,183 @@ class TestMongoDBCommonMethods(unittest.TestCase):
         result = mongodb_common.is_auth_enabled(fake_module)
         assert result is False
 
+    def _probe_module(self):
+        fake_module = FakeAnsibleModule()
+        fake_module.params = dict(FakeAnsibleModule.params, replica_set=None, login_user='admin', login_password='secret',
+                                  login_database='admin', strict_compatibility=True)
+        return fake_module
+
+    def test_connect_round_trips(self):
+        original_client = mongodb_common.MongoClient
+        try:
+            for direct, clients in [(True, 2), (False, 3)]:
+                server = FakeMongoServer()
+                mongodb_common.MongoClient = server.MongoClient
+                fake_module = self._probe_module()
+                client = mongodb_common.get_mongodb_client(fake_module, directConnection=direct)
+                client = mongodb_common.mongo_auth(fake_module, client, directConnection=direct)
+                self.assertEqual('', fake_module.get_msg())
+                self.assertEqual('admin', client.kwargs['username'])
+                # One probe for the topology and auth state. buildInfo is only sent by the authenticated client,
+                # it checks the credentials and gets the version, no more commands than hello, listDatabases
+                # and server_info sent before the probe.
+                self.assertEqual(['hello', 'listDatabases', 'buildInfo'], server.commands)
+                # A direct client is reused for the probe, otherwise a temporary one is built
+                self.assertEqual(clients, len(server.clients))
+                self.assertEqual([True] * (clients - 1) + [False], [c.closed for c in server.clients])
+
+                # Wrong credentials fail the module in mongo_auth
+                server = FakeMongoServer(password='other')
+                mongodb_common.MongoClient = server.MongoClient
+                fake_module = self._probe_module()
+                client = mongodb_common.get_mongodb_client(fake_module, directConnection=direct)
+                mongodb_common.mongo_auth(fake_module, client, directConnection=direct)
+                self.assertEqual('unable to connect to database: Authentication failed.', fake_module.get_msg())
+        finally:
+            mongodb_common.MongoClient = original_client
+
+    def test_connect_round_trips_no_auth(self):
+        original_client = mongodb_common.MongoClient
+        try:
+            server = FakeMongoServer(auth_enabled=False)
+            mongodb_common.MongoClient = server.MongoClient
+            fake_module = self._probe_module()
+            client = mongodb_common.get_mongodb_client(fake_module, directConnection=True)
+            self.assertIs(client, mongodb_common.mongo_auth(fake_module, client, directConnection=True))
+            # The probe client is returned, it asks the version itself
+            self.assertEqual(['hello', 'listDatabases', 'buildInfo'], server.commands)
+            self.assertEqual(1, len(server.clients))
+            self.assertTrue(mongodb_common.is_auth_enabled(fake_module) is False)
+            self.assertEqual(2, len(server.clients))
+        finally:
+            mongodb_common.MongoClient = original_client
+
+    def test_topology_cache(self):
+        original_client = mongodb_common.MongoClient
+        original_gettempdir = mongodb_common.tempfile.gettempdir
+        directory = tempfile.mkdtemp()
+        try:
+            mongodb_common.tempfile.gettempdir = lambda: directory
+            os.environ[mongodb_common.TOPOLOGY_CACHE_TTL_ENV] = '60'
+            server = FakeMongoServer()
+            mongodb_common.MongoClient = server.MongoClient
+            fake_module = self._probe_module()
+            for dummy in range(3):
+                client = mongodb_common.get_mongodb_client(fake_module, directConnection=True)
+                client = mongodb_common.mongo_auth(fake_module, client, directConnection=True)
+                self.assertEqual('admin', client.kwargs['username'])
+            # Probed once, the next runs read the cached facts and only check the credentials, one command
+            # instead of the three sent before the cache
+            self.assertEqual(['hello', 'listDatabases', 'buildInfo', 'buildInfo', 'buildInfo'], server.commands)
+            path = mongodb_common.topology_cache_path()
+            self.assertEqual(0o600, stat.S_IMODE(os.stat(path).st_mode))
+            self.assertEqual({'auth_enabled': True, 'hello': None, 'version': '7.0.2', 'set_name': None},
+                             mongodb_common.get_cached_topology(fake_module))
+            # Facts of another instance are not shared
+            other_module = self._probe_module()
+            other_module.params['login_port'] = 27018
+            self.assertIsNone(mongodb_common.get_cached_topology(other_module))
+
+            # Without credentials the cached auth state fails the module and is dropped
+            fake_module.params.update(login_user=None, login_password=None)
+            original_load_mongocnf = mongodb_common.load_mongocnf
+            mongodb_common.load_mongocnf = lambda: False
+            try:
+                mongodb_common.mongo_auth(fake_module, client, directConnection=True)
+            finally:
+                mongodb_common.load_mongocnf = original_load_mongocnf
+            self.assertEqual('No credentials to authenticate', fake_module.get_msg())
+            self.assertIsNone(mongodb_common.get_cached_topology(fake_module))
+
+            mongodb_common.is_auth_enabled(fake_module)
+            self.assertEqual(7, len(server.commands))
+            os.environ[mongodb_common.TOPOLOGY_CACHE_TTL_ENV] = '0'
+            self.assertIsNone(mongodb_common.get_cached_topology(fake_module))
+        finally:
+            os.environ.pop(mongodb_common.TOPOLOGY_CACHE_TTL_ENV, None)
+            mongodb_common.tempfile.gettempdir = original_gettempdir
+            mongodb_common.MongoClient = original_client
+            shutil.rmtree(directory)
+
+    def test_topology_cache_stale(self):
+        original_client = mongodb_common.MongoClient
+        original_gettempdir = mongodb_common.tempfile.gettempdir
+        directory = tempfile.mkdtemp()
+        try:
+            mongodb_common.tempfile.gettempdir = lambda: directory
+            os.environ[mongodb_common.TOPOLOGY_CACHE_TTL_ENV] = '60'
+            server = FakeMongoServer(auth_enabled=False)
+            mongodb_common.MongoClient = server.MongoClient
+            fake_module = self._probe_module()
+            client = mongodb_common.get_mongodb_client(fake_module, directConnection=True)
+            mongodb_common.mongo_auth(fake_module, client, directConnection=True)
+            self.assertFalse(mongodb_common.get_cached_topology(fake_module)['auth_enabled'])
+
+            # Auth enabled since the facts were cached, they are probed again and the client authenticates
+            server.auth_enabled = True
+            del server.commands[:]
+            client = mongodb_common.get_mongodb_client(fake_module, directConnection=True)
+            client = mongodb_common.mongo_auth(fake_module, client, directConnection=True)
+            self.assertEqual('', fake_module.get_msg())
+            self.assertEqual('admin', client.kwargs['username'])
+            self.assertEqual(['listDatabases', 'hello', 'listDatabases', 'buildInfo'], server.commands)
+            self.assertTrue(mongodb_common.get_cached_topology(fake_module)['auth_enabled'])
+
+            # Failed authentication drops the cached facts
+            server.password = 'other'
+            client = mongodb_common.get_mongodb_client(fake_module, directConnection=True)
+            mongodb_common.mongo_auth(fake_module, client, directConnection=True)
+            self.assertEqual('unable to connect to database: Authentication failed.', fake_module.get_msg())
+            self.assertIsNone(mongodb_common.get_cached_topology(fake_module))
+        finally:
+            os.environ.pop(mongodb_common.TOPOLOGY_CACHE_TTL_ENV, None)
+            mongodb_common.tempfile.gettempdir = original_gettempdir
+            mongodb_common.MongoClient = original_client
+            shutil.rmtree(directory)
+
+    def test_run_commands(self):
+        class FakeClient:
+            def __init__(self):
+                self.lock = threading.Lock()
+                self.running = 0
+                self.max_running = 0
+
+            def __getitem__(self, dbname):
+                client = self
+
+                class FakeDatabase:
+                    def command(self, command):
+                        with client.lock:
+                            client.running += 1
+                            client.max_running = max(client.max_running, client.running)
+                        try:
+                            # The first commands are the slowest, the results must keep their order
+                            time.sleep(command['delay'])
+                            if dbname == 'broken':
+                                raise mongodb_common.OperationFailure('not authorized on broken', code=13)
+                            return {'db': dbname, 'ok': 1}
+                        finally:
+                            with client.lock:
+                                client.running -= 1
+                return FakeDatabase()
+
+        dbnames = ['db%d' % i for i in range(8)]
+        dbnames[3] = 'broken'
+        commands = [(dbname, {'delay': 0.05 - i * 0.005}) for i, dbname in enumerate(dbnames)]
+        for max_workers, max_running in [(3, 3), (1, 1)]:
+            client = FakeClient()
+            results = mongodb_common.run_commands(client, commands, max_workers=max_workers)
+            self.assertEqual(max_running, client.max_running)
+            self.assertEqual(len(commands), len(results))
+            for dbname, (result, excep) in zip(dbnames, results):
+                if dbname == 'broken':
+                    self.assertIsNone(result)
+                    self.assertEqual(13, excep.code)
+                else:
+                    self.assertEqual({'db': dbname, 'ok': 1}, result)
+                    self.assertIsNone(excep)
+        self.assertEqual([], mongodb_common.run_commands(FakeClient(), []))
+
     def test_convert_to_supported_timestamp(self):
         dt = Timestamp(datetime.datetime.now(), 0)
         assert isinstance(dt, Timestamp)
@@ -561,6 +794,36 @@ class TestMongoDBCommonMethods(unittest.TestCase):
         assert isinstance(d["i"], int)
         assert isinstance(d["s"], str)
 
+    def test_lazy_pymongo_import(self):
+        # A fresh interpreter, pymongo is already imported by this test module
+        code = (
+            "import sys; sys.path.insert(0, {0!r}); import mongodb_common; "
+            "print([name in sys.modules for name in ('pymongo', 'bson', 'ssl', 'configparser')]); "
+            "from mongodb_common import pymongo_found, OperationFailure; "
+            "print(pymongo_found, OperationFailure.__module__)"
+        ).format(path)
+        output = subprocess.check_output([sys.executable, "-c", code]).decode().splitlines()
+        self.assertEqual("[False, False, False, False]", output[0])
+        self.assertEqual("True pymongo.errors", output[1])
+
+    def test_lazy_pymongo_import_modules(self):
+        modules_path = os.path.join(path, '..', 'modules')
+        # mongodb_parameter catches OperationFailure, which is imported with the module
+        names = sorted(name[:-3] for name in os.listdir(modules_path)
+                       if name.endswith('.py') and name != 'mongodb_parameter.py'
+                       and 'mongodb_common import' in open(os.path.join(modules_path, name)).read())
+        self.assertIn('mongodb_index', names)
+        code = (
+            "import sys, importlib; "
+            "[importlib.import_module('ansible_collections.community.mongodb.plugins.modules.' + name) for name in {0!r}]; "
+            "print('pymongo' in sys.modules); "
+            "from ansible_collections.community.mongodb.plugins.module_utils import mongodb_common; "
+            "mongodb_common.check_pymongo(None); "
+            "print('pymongo' in sys.modules)"
+        ).format(names)
+        output = subprocess.check_output([sys.executable, "-c", code]).decode().splitlines()
+        self.assertEqual(["False", "True"], output)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,154 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+path = os.path.dirname(os.path.realpath(__file__))
+path = "{0}/../../plugins/module_utils".format(path)
+sys.path.append(path)
+import mongodb_broker
+import pymongo
+from pymongo.errors import OperationFailure
+
+
+class FakeDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def command(self, command, value=1):
+        if isinstance(command, str):
+            command = {command: value}
+        self.client.commands.append((self.name, dict(command)))
+        if 'dropUser' in command:
+            raise OperationFailure('User not found', 11, {'ok': 0, 'code': 11})
+        return {'ok': 1, 'echo': command}
+
+
+class FakeMongoClient:
+    instances = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.commands = []
+        self.closed = False
+        FakeMongoClient.instances.append(self)
+
+    def __getitem__(self, name):
+        return FakeDatabase(self, name)
+
+    def close(self):
+        self.closed = True
+
+
+class TestMongoDBBroker(unittest.TestCase):
+
+    def setUp(self):
+        FakeMongoClient.instances = []
+        self.original_client = pymongo.MongoClient
+        pymongo.MongoClient = FakeMongoClient
+        # Short path, UNIX socket paths are limited to about a hundred bytes
+        self.directory = tempfile.mkdtemp(dir='/tmp')
+        os.chmod(self.directory, 0o700)
+        self.params = {'host': 'localhost', 'port': 27017, 'username': 'admin', 'password': 'secret'}
+
+    def tearDown(self):
+        pymongo.MongoClient = self.original_client
+        shutil.rmtree(self.directory)
+
+    def _serve(self, idle_ttl=30):
+        socket_path = mongodb_broker.broker_socket_path(self.params, self.directory)
+        broker = mongodb_broker.Broker(socket_path, self.params, idle_ttl)
+        thread = threading.Thread(target=broker.serve)
+        thread.daemon = True
+        thread.start()
+        for dummy in range(100):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.01)
+        return broker, thread, socket_path
+
+    def test_commands_through_broker(self):
+        broker, thread, socket_path = self._serve()
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(socket_path).st_mode))
+        for dummy in range(3):
+            client = mongodb_broker.connect_broker(self.params, self.directory)
+            reply = client['test'].command('createUser', 'bob', pwd='pass', roles=['read'])
+            self.assertEqual({'createUser': 'bob', 'pwd': 'pass', 'roles': ['read']}, dict(reply['echo']))
+            self.assertEqual(['createUser', 'pwd', 'roles'], list(reply['echo']))
+            with self.assertRaises(OperationFailure) as context:
+                client.admin.command('dropUser', 'bob')
+            self.assertEqual(11, context.exception.code)
+            client.close()
+        # Every run shares the single client of the broker
+        self.assertEqual(1, len(FakeMongoClient.instances))
+        self.assertEqual(self.params, FakeMongoClient.instances[0].kwargs)
+        broker.idle_ttl = 0
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(socket_path))
+        self.assertTrue(FakeMongoClient.instances[0].closed)
+
+    def test_no_broker(self):
+        self.assertIsNone(mongodb_broker.connect_broker(self.params, self.directory))
+        broker, thread, socket_path = self._serve()
+        # Other credentials never reach the broker
+        self.assertIsNone(mongodb_broker.connect_broker(dict(self.params, password='other'), self.directory))
+        broker.idle_ttl = 0
+        thread.join(5)
+
+    def test_idle_ttl(self):
+        broker, thread, socket_path = self._serve(idle_ttl=1)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(socket_path))
+
+    def test_no_fork_with_threads(self):
+        # pymongo monitor threads would be forked along with their locks
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        original_fork = mongodb_broker.os.fork
+        try:
+            mongodb_broker.os.fork = lambda: self.fail('forked a multithreaded process')
+            self.assertFalse(mongodb_broker.start_broker(self.params, 30, self.directory))
+        finally:
+            mongodb_broker.os.fork = original_fork
+            stop.set()
+            thread.join()
+
+    def test_broker_dir_must_be_private(self):
+        os.chmod(self.directory, 0o755)
+        original_gettempdir = tempfile.gettempdir
+        try:
+            tempfile.gettempdir = lambda: self.directory
+            private = mongodb_broker.broker_dir()
+            self.assertEqual(0o700, stat.S_IMODE(os.stat(private).st_mode))
+            os.chmod(private, 0o770)
+            self.assertIsNone(mongodb_broker.broker_dir())
+        finally:
+            tempfile.gettempdir = original_gettempdir
+
+    def test_broker_idle_ttl(self):
+        original = os.environ.pop(mongodb_broker.BROKER_TTL_ENV, None)
+        try:
+            self.assertEqual(0, mongodb_broker.broker_idle_ttl())
+            os.environ[mongodb_broker.BROKER_TTL_ENV] = '120'
+            self.assertEqual(120, mongodb_broker.broker_idle_ttl())
+            os.environ[mongodb_broker.BROKER_TTL_ENV] = 'yes'
+            self.assertEqual(0, mongodb_broker.broker_idle_ttl())
+        finally:
+            os.environ.pop(mongodb_broker.BROKER_TTL_ENV, None)
+            if original is not None:
+                os.environ[mongodb_broker.BROKER_TTL_ENV] = original
+
+
+if __name__ == '__main__':
+    unittest.main()
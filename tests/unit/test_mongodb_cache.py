@@ -0,0 +1,608 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import unittest
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+import bson
+import datetime
+import pymongo
+from ansible.errors import AnsibleError
+from ansible.plugins.loader import cache_loader
+from ansible_collections.community.mongodb.plugins.cache import mongodb as cache_mongodb
+
+
+class FakeWriteResult:
+    def __init__(self, matched_count, upserted_count, acknowledged=True):
+        self._matched_count = matched_count
+        self._upserted_count = upserted_count
+        self.acknowledged = acknowledged
+
+    def _count(self, count):
+        if not self.acknowledged:
+            # As pymongo does for w=0
+            raise pymongo.errors.InvalidOperation('Unacknowledged write results do not have counts')
+        return count
+
+    @property
+    def matched_count(self):
+        return self._count(self._matched_count)
+
+    @property
+    def upserted_count(self):
+        return self._count(self._upserted_count)
+
+
+class FakeCollection:
+    """
+    Minimal in-memory stand in for a pymongo collection.
+    """
+    def __init__(self, name='cache', database=None):
+        self.name = name
+        self.full_name = 'ansible.%s' % name
+        self.database = database
+        self.docs = {}
+        self.indexes = [{'name': '_id_', 'key': {'_id': 1}}]
+        self.calls = []
+
+    def _matches(self, doc, query):
+        for field, cond in query.items():
+            value = doc.get(field)
+            if isinstance(cond, dict):
+                if '$regex' in cond and not (isinstance(value, str) and re.search(cond['$regex'], value)):
+                    return False
+                if '$gte' in cond and not value >= cond['$gte']:
+                    return False
+                if '$lt' in cond and not value < cond['$lt']:
+                    return False
+                if '$in' in cond and value not in cond['$in']:
+                    return False
+            elif value != cond:
+                return False
+        return True
+
+    def find_one(self, query):
+        self.calls.append('find_one')
+        for doc in self.docs.values():
+            if self._matches(doc, query):
+                return dict(doc)
+        return None
+
+    def find(self, query, projection=None, **kwargs):
+        self.calls.append('find')
+        return [dict(doc) for doc in self.docs.values() if self._matches(doc, query)]
+
+    def count_documents(self, query):
+        self.calls.append('count_documents')
+        return len([doc for doc in self.docs.values() if self._matches(doc, query)])
+
+    def update_one(self, query, update, upsert=False):
+        self.calls.append('update_one')
+        matched = query['_id'] in self.docs
+        if not matched and not upsert:
+            return FakeWriteResult(0, 0)
+        doc = self.docs.setdefault(query['_id'], {'_id': query['_id']})
+        for path, value in update.get('$set', {}).items():
+            target = doc
+            parts = path.split('.')
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+        for path in update.get('$unset', {}):
+            target = doc
+            parts = path.split('.')
+            for part in parts[:-1]:
+                target = target.get(part, {})
+            target.pop(parts[-1], None)
+        return FakeWriteResult(int(matched), int(not matched), self._acknowledged())
+
+    def _acknowledged(self):
+        write_concern = getattr(self, 'write_concern', None)
+        return write_concern is None or write_concern.acknowledged
+
+    def bulk_write(self, requests, ordered=True):
+        self.calls.append('bulk_write')
+        results = [self.update_one(request._filter, request._doc, upsert=request._upsert) for request in requests]
+        if not self._acknowledged():
+            return FakeWriteResult(0, 0, False)
+        return FakeWriteResult(sum(r.matched_count for r in results), sum(r.upserted_count for r in results))
+
+    def delete_one(self, query):
+        self.calls.append('delete_one')
+        self.docs.pop(query['_id'], None)
+
+    def delete_many(self, query):
+        self.calls.append('delete_many')
+        for key in [k for k, doc in self.docs.items() if self._matches(doc, query)]:
+            del self.docs[key]
+
+    def list_indexes(self):
+        self.calls.append('list_indexes')
+        return list(self.indexes)
+
+    def create_index(self, key, name, expireAfterSeconds):
+        self.calls.append('create_index')
+        self.indexes.append({'name': name, 'key': {key: 1}, 'expireAfterSeconds': expireAfterSeconds})
+
+    def drop_index(self, name):
+        self.calls.append('drop_index')
+        self.indexes = [index for index in self.indexes if index['name'] != name]
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection(name, self)
+        return collection
+
+    def get_collection(self, name, read_preference=None, write_concern=None):
+        collection = self[name]
+        collection.read_preference = read_preference
+        collection.write_concern = write_concern
+        return collection
+
+    def command(self, name, value, **kwargs):
+        collection = self[value]
+        collection.calls.append(name)
+        if name == 'collMod':
+            for index in collection.indexes:
+                if index['name'] == kwargs['index']['name']:
+                    index['expireAfterSeconds'] = kwargs['index']['expireAfterSeconds']
+
+
+class FakeMongoClient:
+    instances = []
+
+    def __init__(self, uri=None, **kwargs):
+        self.uri = uri
+        self.kwargs = kwargs
+        self.closed = False
+        self.databases = {}
+        FakeMongoClient.instances.append(self)
+
+    def get_default_database(self):
+        raise pymongo.errors.ConfigurationError('No default database')
+
+    def __getitem__(self, name):
+        return self.databases.setdefault(name, FakeDatabase())
+
+    def close(self):
+        self.closed = True
+
+
+class TestMongoDBCacheMethods(unittest.TestCase):
+
+    def setUp(self):
+        FakeMongoClient.instances = []
+        self.original_client = cache_mongodb.pymongo.MongoClient
+        cache_mongodb.pymongo.MongoClient = FakeMongoClient
+        cache_mongodb._close_clients()
+        cache_mongodb._reconciled_indexes.clear()
+
+    def tearDown(self):
+        cache_mongodb._close_clients()
+        cache_mongodb.pymongo.MongoClient = self.original_client
+
+    def _cache(self, **kwargs):
+        options = {'_uri': 'mongodb://localhost:27017', '_timeout': 0}
+        options.update(kwargs)
+        plugin = cache_loader.get('community.mongodb.mongodb', **options)
+        # Newer ansible-core releases wrap the plugin to serialize the facts, test the plugin itself
+        return getattr(plugin, '__wrapped__', plugin)
+
+    def test_client_reused_across_calls(self):
+        cache = self._cache()
+        for host in range(50):
+            cache.set('host%d' % host, {'ansible_hostname': 'host%d' % host})
+            cache.get('host%d' % host)
+            cache.contains('host%d' % host)
+        cache.keys()
+        cache.copy()
+        # A fresh plugin instance, as built by __setstate__ in each worker, shares the same client
+        self._cache().contains('host0')
+        self.assertEqual(1, len(FakeMongoClient.instances))
+
+    def test_client_rebuilt_after_fork(self):
+        cache = self._cache()
+        cache.contains('host0')
+        original_getpid = cache_mongodb.os.getpid
+        try:
+            cache_mongodb.os.getpid = lambda: -1
+            cache.contains('host0')
+        finally:
+            cache_mongodb.os.getpid = original_getpid
+        self.assertEqual(2, len(FakeMongoClient.instances))
+        # The parent's client must be left alone by the child
+        self.assertFalse(FakeMongoClient.instances[0].closed)
+
+    def test_clients_closed_at_exit(self):
+        self._cache().contains('host0')
+        cache_mongodb._close_clients()
+        self.assertTrue(FakeMongoClient.instances[0].closed)
+        self.assertEqual({}, cache_mongodb._clients)
+
+    def _collection(self):
+        return FakeMongoClient.instances[0]['ansible']['cache']
+
+    def test_write_behind_size_threshold(self):
+        cache = self._cache(_write_behind=True, _write_behind_size=10, _write_behind_interval=3600)
+        for host in range(25):
+            cache.set('host%d' % host, {'ansible_hostname': 'host%d' % host})
+        collection = self._collection()
+        self.assertEqual(2, collection.calls.count('bulk_write'))
+        self.assertNotIn('update_one', collection.calls[:collection.calls.index('bulk_write')])
+        self.assertEqual(20, len(collection.docs))
+        self.assertTrue(cache.contains('host24'))
+        self.assertEqual({'ansible_hostname': 'host24'}, cache.get('host24'))
+        cache._flush_pending()
+        self.assertEqual(25, len(collection.docs))
+
+    def test_write_behind_interval_threshold(self):
+        cache = self._cache(_write_behind=True, _write_behind_size=100, _write_behind_interval=0)
+        cache.set('host0', {'a': 1})
+        self.assertEqual(1, len(self._collection().docs))
+
+    def test_write_behind_keeps_latest_value_per_key(self):
+        cache = self._cache(_write_behind=True, _write_behind_interval=3600)
+        cache.set('host0', {'a': 1})
+        cache.set('host0', {'a': 2})
+        cache.set('host1', {'a': 1})
+        cache.delete('host1')
+        cache._flush_pending()
+        collection = self._collection()
+        self.assertEqual({'a': 2}, collection.docs['ansible_factshost0']['data'])
+        self.assertNotIn('ansible_factshost1', collection.docs)
+
+    def test_write_behind_flushed_at_exit(self):
+        cache = self._cache(_write_behind=True, _write_behind_interval=3600)
+        cache.set('host0', {'a': 1})
+        cache_mongodb._flush_write_behind()
+        self.assertEqual(1, len(self._collection().docs))
+
+    def test_write_behind_failure_reported(self):
+        cache = self._cache(_write_behind=True, _write_behind_interval=3600)
+        cache.contains('host0')
+        cache.set('host0', {'a': 1})
+
+        def bulk_write(requests, ordered=True):
+            raise pymongo.errors.BulkWriteError({'writeErrors': [{'index': 0, 'errmsg': 'boom'}]})
+
+        self._collection().bulk_write = bulk_write
+        with self.assertRaises(AnsibleError) as context:
+            cache._flush_pending()
+        self.assertIn('1 host(s)', str(context.exception))
+
+    def test_prefetch_single_query(self):
+        writer = self._cache()
+        for host in range(20):
+            writer.set('host%d' % host, {'ansible_hostname': 'host%d' % host})
+        self._collection().docs['other_prefixhost0'] = {'_id': 'other_prefixhost0', 'data': {'a': 1}}
+        self._collection().calls = []
+
+        cache = self._cache(_prefetch=True)
+        for host in range(25):
+            if cache.contains('host%d' % host):
+                self.assertEqual({'ansible_hostname': 'host%d' % host}, cache.get('host%d' % host))
+            else:
+                self.assertEqual({}, cache.get('host%d' % host))
+        self.assertFalse(cache.contains('0'))
+        self.assertEqual(['find'], [call for call in self._collection().calls if 'index' not in call])
+
+        cache.set('host30', {'a': 1})
+        self.assertTrue(cache.contains('host30'))
+        cache.delete('host30')
+        self.assertFalse(cache.contains('host30'))
+
+    def _facts(self, host):
+        return {
+            'ansible_hostname': host,
+            'ansible_date_time': {'epoch': '1700000000', 'iso8601': '2023-11-14T22:13:20Z'},
+            'ansible_mounts': [
+                {'mount': '/srv/data%d' % i, 'device': '/dev/sd%s%d' % (chr(97 + i % 26), i), 'fstype': 'xfs',
+                 'options': 'rw,seclabel,relatime,attr2,inode64,logbufs=8,logbsize=32k,noquota',
+                 'size_total': 1073741824 * i, 'size_available': 536870912 * i, 'block_size': 4096}
+                for i in range(200)
+            ],
+            'ansible_interfaces': ['eth%d' % i for i in range(32)],
+            'ansible_env': dict(('VAR_%d' % i, '/usr/local/lib/value/%d' % i) for i in range(100)),
+        }
+
+    def test_compression_round_trip(self):
+        for codec in [c for c in ('zlib', 'bz2', 'lzma', 'zstd') if c in cache_mongodb._codecs]:
+            cache = self._cache(_compression=codec)
+            cache.set('host0', self._facts('host0'))
+            doc = self._collection().docs['ansible_factshost0']
+            self.assertEqual(codec, doc['codec'])
+            self.assertIsInstance(doc['data'], bytes)
+            # Compressed facts are a fraction of the plain BSON document
+            self.assertLess(len(doc['data']) * 5, len(bson.encode(self._facts('host0'))))
+
+            reader = self._cache(_compression=codec)
+            self.assertEqual(self._facts('host0'), reader.get('host0'))
+            self.assertEqual(self._facts('host0'), reader.copy()['host0'])
+
+    def test_compression_without_bz2_and_lzma(self):
+        # Python built without libbz2 and liblzma, the plugin loads with the remaining codecs
+        code = (
+            "import sys; sys.modules['bz2'] = sys.modules['lzma'] = None; "
+            "from ansible_collections.community.mongodb.plugins.cache import mongodb; "
+            "print(sorted(c for c in mongodb._codecs if c != 'zstd'))"
+        )
+        output = subprocess.check_output([sys.executable, '-c', code]).decode().strip()
+        self.assertEqual("['zlib']", output)
+
+    def test_compression_reads_legacy_documents(self):
+        self._cache().set('host0', self._facts('host0'))
+        cache = self._cache(_compression='zlib')
+        self.assertEqual(self._facts('host0'), cache.get('host0'))
+
+        cache.set('host0', self._facts('host0'))
+        plain = self._cache()
+        self.assertEqual(self._facts('host0'), plain.get('host0'))
+        plain.set('host0', self._facts('host0'))
+        self.assertNotIn('codec', self._collection().docs['ansible_factshost0'])
+
+    def test_delta_updates(self):
+        cache = self._cache(_delta_updates=True)
+        updates = []
+        facts = self._facts('host0')
+        cache.set('host0', facts)
+        collection = self._collection()
+        original_update_one = collection.update_one
+
+        def update_one(query, update, upsert=False):
+            updates.append(update)
+            return original_update_one(query, update, upsert=upsert)
+
+        collection.update_one = update_one
+
+        # The facts are updated in place, as ansible-core does
+        facts['ansible_date_time']['epoch'] = '1700000060'
+        facts['ansible_mounts'][0]['size_available'] = 1
+        del facts['ansible_env']['VAR_0']
+        facts['ansible_local'] = {'role': 'web'}
+        cache.set('host0', facts)
+        self.assertEqual(
+            {
+                '_id': 'ansible_factshost0',
+                'date': updates[0]['$set']['date'],
+                'data.ansible_date_time.epoch': '1700000060',
+                'data.ansible_mounts': facts['ansible_mounts'],
+                'data.ansible_local': {'role': 'web'},
+            },
+            updates[0]['$set'])
+        self.assertEqual({'data.ansible_env.VAR_0': ''}, updates[0]['$unset'])
+        self.assertEqual(facts, collection.docs['ansible_factshost0']['data'])
+
+        # Keys which are not valid field paths replace their parent
+        facts['ansible_local'] = {'role.name': 'web'}
+        cache.set('host0', facts)
+        self.assertEqual({'role.name': 'web'}, updates[1]['$set']['data.ansible_local'])
+
+        # Hosts never read nor written are written in full
+        self._cache(_delta_updates=True).set('host1', facts)
+        self.assertEqual(facts, updates[2]['$set']['data'])
+
+    def test_delta_updates_removed_document(self):
+        for write_behind in (False, True):
+            cache = self._cache(_delta_updates=True, _write_behind=write_behind, _write_behind_interval=3600)
+            facts = self._facts('host0')
+            cache.set('host0', facts)
+            cache.set('host1', self._facts('host1'))
+            cache._flush_pending()
+            collection = self._collection()
+
+            # Expired or flushed by another controller between the read and the write
+            del collection.docs['ansible_factshost0']
+            facts['ansible_date_time']['epoch'] = '1700000060'
+            cache.set('host0', facts)
+            cache.set('host1', self._facts('host1'))
+            cache._flush_pending()
+            # Written in full, never as a document holding only the changed facts
+            self.assertEqual(facts, collection.docs['ansible_factshost0']['data'])
+            self.assertEqual(self._facts('host1'), collection.docs['ansible_factshost1']['data'])
+            self.assertEqual(facts, self._cache().get('host0'))
+            collection.docs.clear()
+
+    def test_prefix_scoping(self):
+        team_a = self._cache(_prefix='team_a_')
+        team_b = self._cache(_prefix='team_b_')
+        team_a.set('host0', {'a': 1})
+        team_a.set('host1', {'a': 1})
+        team_b.set('host0', {'b': 1})
+        self._collection().docs['team_a'] = {'_id': 'team_a', 'data': {}}
+
+        self.assertEqual({'_id': {'$gte': 'team_a_', '$lt': 'team_a`'}}, team_a._prefix_filter())
+        self.assertEqual(['host0', 'host1'], sorted(team_a.keys()))
+        self.assertEqual({'host0': {'b': 1}}, team_b.copy())
+
+        team_a.flush()
+        self.assertEqual([], team_a.keys())
+        self.assertEqual(['team_a', 'team_b_host0'], sorted(self._collection().docs))
+
+    def test_ttl_index_reconciled_once(self):
+        for worker in range(10):
+            self._cache(_timeout=3600).contains('host0')
+        collection = self._collection()
+        self.assertEqual(['list_indexes', 'create_index'], [call for call in collection.calls if 'index' in call])
+        self.assertEqual(3600, collection.indexes[-1]['expireAfterSeconds'])
+
+    def test_ttl_index_changed_with_collmod(self):
+        self._cache(_timeout=3600).contains('host0')
+        collection = self._collection()
+        collection.calls = []
+        self._cache(_timeout=60).contains('host0')
+        self._cache(_timeout=60).contains('host0')
+        self.assertEqual(['list_indexes', 'collMod', 'count_documents', 'count_documents'], collection.calls)
+        self.assertEqual(60, collection.indexes[-1]['expireAfterSeconds'])
+
+    def test_ttl_index_dropped_without_timeout(self):
+        self._cache(_timeout=3600).contains('host0')
+        self._cache(_timeout=0).contains('host0')
+        self.assertEqual(['_id_'], [index['name'] for index in self._collection().indexes])
+
+    def test_ttl_index_on_another_key_rebuilt(self):
+        self._cache(_timeout=0).contains('host0')
+        collection = self._collection()
+        collection.indexes.append({'name': 'ttl', 'key': {'other': 1}})
+        self._cache(_timeout=60).contains('host0')
+        self.assertEqual({'name': 'ttl', 'key': {'date': 1}, 'expireAfterSeconds': 60}, collection.indexes[-1])
+
+    def test_read_preference_and_write_concern(self):
+        self._cache().contains('host0')
+        self.assertIsNone(self._collection().read_preference)
+        self.assertIsNone(self._collection().write_concern)
+
+        self._cache(_read_preference='secondaryPreferred', _max_staleness_seconds=90,
+                    _write_concern_w='0', _journal=False).contains('host0')
+        read_preference = self._collection().read_preference
+        self.assertEqual('secondaryPreferred', read_preference.mongos_mode)
+        self.assertEqual(90, read_preference.max_staleness)
+        self.assertEqual({'w': 0, 'j': False}, self._collection().write_concern.document)
+
+        self._cache(_write_concern_w='majority').contains('host0')
+        self.assertEqual({'w': 'majority'}, self._collection().write_concern.document)
+
+    def test_invalid_read_preference_and_write_concern(self):
+        with self.assertRaises(AnsibleError):
+            self._cache(_read_preference='primary', _max_staleness_seconds=90)
+        with self.assertRaises(AnsibleError):
+            self._cache(_max_staleness_seconds=90)
+        with self.assertRaises(AnsibleError):
+            self._cache(_write_concern_w='0', _journal=True)
+        with self.assertRaisesRegex(AnsibleError, 'unacknowledged'):
+            self._cache(_write_concern_w='0', _delta_updates=True)
+
+    def test_unacknowledged_writes(self):
+        cache = self._cache(_write_concern_w='0', _write_behind=True, _write_behind_interval=3600)
+        cache.set('host0', self._facts('host0'))
+        cache.set('host1', self._facts('host1'))
+        cache._flush_pending()
+        cache = self._cache(_write_concern_w='0')
+        cache.set('host0', {'a': 1})
+        self.assertEqual(self._facts('host1'), self._collection().docs['ansible_factshost1']['data'])
+        self.assertEqual({'a': 1}, self._collection().docs['ansible_factshost0']['data'])
+
+    def test_buckets(self):
+        cache = self._cache(_buckets=4, _timeout=60)
+        for host in range(40):
+            cache.set('host%d' % host, {'ansible_hostname': 'host%d' % host})
+        database = FakeMongoClient.instances[0]['ansible']
+        self.assertEqual(['cache_0', 'cache_1', 'cache_2', 'cache_3'], sorted(database))
+        for name, collection in database.items():
+            self.assertTrue(collection.docs)
+            self.assertEqual(60, collection.indexes[-1]['expireAfterSeconds'])
+            for doc_id in collection.docs:
+                self.assertEqual(name, cache._collection_name(doc_id[len('ansible_facts'):]))
+
+        reader = self._cache(_buckets=4, _timeout=60)
+        self.assertEqual({'ansible_hostname': 'host7'}, reader.get('host7'))
+        self.assertEqual(40, len(reader.keys()))
+        self.assertEqual({'ansible_hostname': 'host39'}, reader.copy()['host39'])
+
+        writer = self._cache(_buckets=4, _timeout=60, _write_behind=True, _write_behind_interval=3600)
+        writer.set('host40', {'a': 1})
+        writer.set('host41', {'a': 1})
+        self.assertEqual(42, len(writer.keys()))
+
+        reader.flush()
+        self.assertEqual([], reader.keys())
+
+    def test_local_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'facts', 'cache.sqlite')
+            self._cache(_local_cache_path=path).set('host0', {'a': 1})
+            self.assertEqual(0o600, os.stat(path).st_mode & 0o777)
+            collection = self._collection()
+            collection.calls = []
+
+            # A later run is served from the local copy
+            cache = self._cache(_local_cache_path=path)
+            self.assertTrue(cache.contains('host0'))
+            self.assertEqual({'a': 1}, cache.get('host0'))
+            self.assertEqual([], collection.calls)
+
+            # Stale copies are served, then refreshed in the background for the next run
+            collection.docs['ansible_factshost0']['data'] = {'a': 2}
+            cache = self._cache(_local_cache_path=path, _local_cache_max_age=0)
+            self.assertEqual({'a': 1}, cache.get('host0'))
+            cache_mongodb._join_refresh_threads()
+            self.assertEqual(['find'], collection.calls)
+            self.assertEqual({'a': 2}, self._cache(_local_cache_path=path).get('host0'))
+
+            # Copies of facts MongoDB expired are not served
+            collection.docs['ansible_factshost0']['date'] = datetime.datetime.utcnow() - datetime.timedelta(hours=2)
+            self._cache(_local_cache_path=path, _local_cache_max_age=0).get('host0')
+            cache_mongodb._join_refresh_threads()
+            collection.docs.clear()
+            self.assertEqual({}, self._cache(_local_cache_path=path, _timeout=3600).get('host0'))
+
+            self._cache(_local_cache_path=path).set('host1', {'a': 1})
+            self._cache(_local_cache_path=path).flush()
+            collection.calls = []
+            self.assertFalse(self._cache(_local_cache_path=path).contains('host1'))
+            self.assertEqual(['count_documents'], collection.calls)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_reset_after_fork(self):
+        # A thread of the controller may hold the locks when a worker is forked
+        locked = cache_mongodb._clients_lock
+        with locked:
+            cache_mongodb._reset_after_fork()
+            self.assertIsNot(locked, cache_mongodb._clients_lock)
+            self.assertFalse(cache_mongodb._clients_lock.locked())
+            self.assertFalse(cache_mongodb._indexes_lock.locked())
+        self._cache().set('host0', {'a': 1})
+
+    def test_local_cache_batched_refresh(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'cache.sqlite')
+            writer = self._cache(_local_cache_path=path)
+            for host in range(25):
+                writer.set('host%d' % host, {'a': host})
+            collection = self._collection()
+            for doc in collection.docs.values():
+                doc['data'] = {'a': -1}
+            del collection.docs['ansible_factshost0']
+            collection.calls = []
+
+            threads = threading.active_count()
+            cache = self._cache(_local_cache_path=path, _local_cache_max_age=0, _batch_size=10)
+            original_refresh = cache._refresh
+            started = threading.Event()
+            release = threading.Event()
+
+            def refresh(entries):
+                started.set()
+                release.wait(5)
+                original_refresh(entries)
+
+            cache._refresh = refresh
+            # The first stale host is being fetched while the others are queued
+            self.assertEqual({'a': 0}, cache.get('host0'))
+            started.wait(5)
+            for host in range(1, 25):
+                self.assertEqual({'a': host}, cache.get('host%d' % host))
+            # A single worker thread whatever the number of stale hosts
+            self.assertEqual(threads + 1, threading.active_count())
+            release.set()
+            cache_mongodb._join_refresh_threads()
+
+            # The queued hosts are fetched together, _batch_size of them per query
+            self.assertEqual(['find'] * 4, collection.calls)
+            reader = self._cache(_local_cache_path=path)
+            self.assertEqual({'a': -1}, reader.get('host24'))
+            self.assertFalse(reader.contains('host0'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,495 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+
+import bson
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from bson.raw_bson import RawBSONDocument
+from bson.son import SON
+from ansible.errors import AnsibleError
+from ansible_collections.community.mongodb.plugins.lookup import mongodb as lookup_mongodb
+
+
+def legacy_convert(result):
+    '''
+    The former recursive converter, the reference for the output of the current one.
+    '''
+    if result is None:
+        return result
+    if isinstance(result, (int, float, bool)):
+        return result
+    if isinstance(result, str):
+        return result
+    elif isinstance(result, list):
+        return [legacy_convert(elem) for elem in result]
+    elif isinstance(result, dict):
+        return dict((key, legacy_convert(value)) for key, value in result.items())
+    elif isinstance(result, datetime.datetime):
+        return (result - datetime.datetime(1970, 1, 1)).total_seconds()
+    else:
+        return u"{0}".format(result)
+
+
+class FakeCursor(list):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+    def explain(self):
+        return {'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}, 'rejectedPlans': []},
+                'executionStats': {'nReturned': len(self), 'totalDocsExamined': len(self)}}
+
+
+class FakeCollection:
+    """
+    Minimal in-memory stand in for a pymongo collection.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.docs = []
+        self.calls = []
+        self.codec_options = DEFAULT_CODEC_OPTIONS
+
+    def with_options(self, codec_options=None):
+        self.codec_options = codec_options
+        return self
+
+    def _documents(self, docs):
+        if self.codec_options.document_class is RawBSONDocument:
+            return [RawBSONDocument(bson.encode(doc)) for doc in docs]
+        return [dict(doc) for doc in docs]
+
+    def find(self, filter=None, **kwargs):
+        self.calls.append(('find', filter, kwargs))
+        if getattr(self, 'delay', None):
+            time.sleep(self.delay)
+        if getattr(self, 'error', None):
+            raise self.error
+        filter = filter or {}
+        self.cursor = FakeCursor(self._documents(doc for doc in self.docs if all(doc.get(k) == v for k, v in filter.items())))
+        return self.cursor
+
+    def count_documents(self, filter, **kwargs):
+        self.calls.append(('count_documents', filter, kwargs))
+        return len(self.find(filter))
+
+    def estimated_document_count(self, **kwargs):
+        self.calls.append(('estimated_document_count', None, kwargs))
+        return len(self.docs)
+
+    def distinct(self, key, filter=None, **kwargs):
+        self.calls.append(('distinct', filter, kwargs))
+        values = []
+        for doc in self.find(filter):
+            if key in doc and doc[key] not in values:
+                values.append(doc[key])
+        return values
+
+    def aggregate(self, pipeline, **kwargs):
+        self.calls.append(('aggregate', pipeline, kwargs))
+        self.cursor = FakeCursor([{'_id': None, 'count': len(self.docs)}])
+        return self.cursor
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection(name)
+        collection.database = self
+        return collection
+
+    def command(self, command):
+        self.commands = getattr(self, 'commands', []) + [command]
+        return {'stages': [{'$cursor': {'queryPlanner': {'winningPlan': {'stage': 'IXSCAN'}},
+                                        'executionStats': {'nReturned': 1}}},
+                           {'$group': {}}]}
+
+
+class FakeMongoClient:
+    instances = []
+
+    def __init__(self, uri=None, **kwargs):
+        self.uri = uri
+        self.kwargs = kwargs
+        self.closed = False
+        self.databases = {}
+        FakeMongoClient.instances.append(self)
+
+    def __getitem__(self, name):
+        return self.databases.setdefault(name, FakeDatabase())
+
+    def close(self):
+        self.closed = True
+
+
+class TestMongoDBLookupMethods(unittest.TestCase):
+
+    def setUp(self):
+        FakeMongoClient.instances = []
+        self.original_client = lookup_mongodb.MongoClient
+        lookup_mongodb.MongoClient = FakeMongoClient
+        lookup_mongodb._close_clients()
+        self.original_gettempdir = tempfile.gettempdir
+        self.directory = tempfile.mkdtemp()
+        tempfile.gettempdir = lambda: self.directory
+
+    def tearDown(self):
+        lookup_mongodb._close_clients()
+        lookup_mongodb.MongoClient = self.original_client
+        tempfile.gettempdir = self.original_gettempdir
+        shutil.rmtree(self.directory)
+
+    def _term(self, **kwargs):
+        term = {'database': 'test', 'collection': 'rs', 'connection_string': 'mongodb://localhost:27017'}
+        term.update(kwargs)
+        return term
+
+    def _collection(self, client=0, database='test', collection='rs'):
+        return FakeMongoClient.instances[client][database][collection]
+
+    def test_client_reused_across_terms_and_lookups(self):
+        term = self._term(extra_connection_parameters={'tls': False, 'appname': 'ansible'})
+        for dummy in range(50):
+            lookup_mongodb.LookupModule().run([term, dict(term)], {})
+        # Parameter order does not matter
+        lookup_mongodb.LookupModule().run([self._term(extra_connection_parameters={'appname': 'ansible', 'tls': False})], {})
+        self.assertEqual(1, len(FakeMongoClient.instances))
+        # The caller's term is left untouched
+        self.assertIn('database', term)
+        self.assertIn('extra_connection_parameters', term)
+
+    def test_client_per_connection(self):
+        lookup = lookup_mongodb.LookupModule()
+        lookup.run([self._term(), self._term(connection_string='mongodb://localhost:27018')], {})
+        lookup.run([self._term(extra_connection_parameters={'tls': True})], {})
+        self.assertEqual(3, len(FakeMongoClient.instances))
+
+    def test_client_rebuilt_after_fork(self):
+        lookup = lookup_mongodb.LookupModule()
+        lookup.run([self._term()], {})
+        original_getpid = lookup_mongodb.os.getpid
+        try:
+            lookup_mongodb.os.getpid = lambda: -1
+            lookup.run([self._term()], {})
+        finally:
+            lookup_mongodb.os.getpid = original_getpid
+        self.assertEqual(2, len(FakeMongoClient.instances))
+        self.assertFalse(FakeMongoClient.instances[0].closed)
+
+    def test_clients_closed_at_exit(self):
+        lookup_mongodb.LookupModule().run([self._term()], {})
+        lookup_mongodb._close_clients()
+        self.assertTrue(FakeMongoClient.instances[0].closed)
+        self.assertEqual({}, lookup_mongodb._clients)
+
+    def _populate(self, count):
+        lookup_mongodb.LookupModule().run([self._term(limit=0)], {})
+        self._collection().docs = [{'_id': i, 'name': 'host%d' % i} for i in range(count)]
+
+    def test_streaming_options_not_sent_as_is(self):
+        self._populate(10)
+        result = lookup_mongodb.LookupModule().run([self._term(batch_size=3, max_documents=20, max_bytes=4096)], {})
+        self.assertEqual(10, len(result))
+        call = self._collection().calls[-1]
+        self.assertEqual(3, call[2]['batch_size'])
+        self.assertEqual(21, call[2]['limit'])
+        self.assertNotIn('max_documents', call[2])
+        self.assertNotIn('max_bytes', call[2])
+        self.assertTrue(self._collection().cursor.closed)
+
+    def test_max_documents_exceeded(self):
+        self._populate(10)
+        with self.assertRaisesRegex(AnsibleError, 'max_documents=9'):
+            lookup_mongodb.LookupModule().run([self._term(max_documents=9)], {})
+        self.assertTrue(self._collection().cursor.closed)
+
+    def test_max_bytes_exceeded(self):
+        self._populate(10)
+        # Each document encodes to 30 bytes
+        self.assertEqual(10, len(lookup_mongodb.LookupModule().run([self._term(max_bytes=300)], {})))
+        with self.assertRaisesRegex(AnsibleError, 'max_bytes=299'):
+            lookup_mongodb.LookupModule().run([self._term(max_bytes=299)], {})
+
+    def test_max_bytes_raw_documents(self):
+        self._populate(2)
+        self._collection().docs[0]['started'] = datetime.datetime(2020, 1, 1)
+        result = lookup_mongodb.LookupModule().run([self._term(max_bytes=1000)], {})
+        # The documents are read as raw BSON and decoded with the codec options of the collection
+        self.assertIs(RawBSONDocument, self._collection().codec_options.document_class)
+        self.assertTrue(all(isinstance(doc, RawBSONDocument) for doc in self._collection().cursor))
+        self.assertEqual([{'_id': 0, 'name': 'host0', 'started': 1577836800.0}, {'_id': 1, 'name': 'host1'}], result)
+
+    def test_aggregate(self):
+        self._populate(10)
+        pipeline = [{'$group': {'_id': None, 'count': {'$sum': 1}}}]
+        term = self._term(aggregate=pipeline, allow_disk_use=True, batch_size=5, max_time_ms=1000, max_documents=3)
+        result = lookup_mongodb.LookupModule().run([term], {})
+        self.assertEqual([{'_id': None, 'count': 10}], result)
+        call = self._collection().calls[-1]
+        self.assertEqual('aggregate', call[0])
+        self.assertEqual(pipeline + [{'$limit': 4}], call[1])
+        self.assertEqual({'allowDiskUse': True, 'batchSize': 5, 'maxTimeMS': 1000}, call[2])
+        # The pipeline of the caller is not extended
+        self.assertEqual(1, len(pipeline))
+
+    def test_aggregate_rejects_find_options(self):
+        with self.assertRaisesRegex(AnsibleError, 'filter cannot be used with aggregate'):
+            lookup_mongodb.LookupModule().run([self._term(aggregate=[], filter={'a': 1})], {})
+        with self.assertRaisesRegex(AnsibleError, 'aggregate must be a list'):
+            lookup_mongodb.LookupModule().run([self._term(aggregate={'$match': {}})], {})
+
+    def test_aggregate_out_stage(self):
+        self._populate(2)
+        for stage in [{'$out': 'copy'}, {'$merge': {'into': 'copy'}}]:
+            with self.assertRaisesRegex(AnsibleError, 'max_documents cannot be used with a pipeline ending in'):
+                lookup_mongodb.LookupModule().run([self._term(aggregate=[{'$match': {}}, stage], max_documents=5)], {})
+            lookup_mongodb.LookupModule().run([self._term(aggregate=[{'$match': {}}, stage])], {})
+            self.assertEqual([{'$match': {}}, stage], self._collection().calls[-1][1])
+
+    def test_convert_matches_legacy_output(self):
+        lookup = lookup_mongodb.LookupModule()
+        document = {
+            '_id': bson.ObjectId('5f1d7c0e9b1e8a3d4c2b1a00'),
+            'name': 'host1', 'port': 27017, 'ratio': 0.5, 'primary': True, 'arbiter': None,
+            'int64': bson.Int64(1 << 40),
+            'started': datetime.datetime(2020, 7, 26, 12, 30, 15, 250000),
+            'members': [
+                {'host': 'a:27017', 'optime': bson.Timestamp(1595766615, 1), 'tags': {'dc': 'east'}},
+                {'host': 'b:27017', 'seen': [datetime.datetime(2020, 1, 1), datetime.datetime(2021, 1, 1)]},
+            ],
+            'son': SON([('b', 1), ('a', {'c': bson.Decimal128('1.5')})]),
+            'deep': [[[[{'x': [bson.Binary(b'abc', 0)]}]]]],
+            'plain': {'a': [1, 2, {'b': 'c'}], 'd': []},
+            'tuple': (1, 2),
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        }
+        result = lookup.convert_mongo_result_to_valid_json(document)
+        self.assertEqual(legacy_convert(document), result)
+        self.assertIs(type(result['son']), dict)
+        # JSON native subtrees are not copied, the input is not modified
+        self.assertIs(document['plain'], result['plain'])
+        self.assertIsInstance(document['started'], datetime.datetime)
+        for value in [None, 1, 'a', 1.5, True, [], {}, [1, [2]], datetime.datetime(2020, 1, 1), bson.ObjectId()]:
+            self.assertEqual(legacy_convert(value), lookup.convert_mongo_result_to_valid_json(value))
+
+    def _finds(self):
+        return len([call for call in self._collection().calls if call[0] == 'find'])
+
+    def test_cache_disabled_by_default(self):
+        self._populate(3)
+        for dummy in range(3):
+            lookup_mongodb.LookupModule().run([self._term()], {})
+        self.assertEqual(4, self._finds())
+
+    def test_cache_identical_terms(self):
+        self._populate(3)
+        term = self._term(filter={'name': 'host1'}, sort=[['name', 'ASCENDING']], limit=5)
+        for dummy in range(10):
+            result = lookup_mongodb.LookupModule().run([dict(term)], {}, cache=True)
+            self.assertEqual([{'_id': 1, 'name': 'host1'}], result)
+            # The memoized result is not shared with the caller
+            result[0]['name'] = 'changed'
+        # The sort of the caller is not converted in place
+        self.assertEqual([['name', 'ASCENDING']], term['sort'])
+        self.assertEqual(2, self._finds())
+        lookup_mongodb.LookupModule().run([self._term(filter={'name': 'host2'})], {}, cache=True)
+        self.assertEqual(3, self._finds())
+
+    def test_cache_shared_by_workers(self):
+        self._populate(3)
+        lookup_mongodb.LookupModule().run([self._term(filter={'name': 'host1'})], {}, cache=True)
+        self.assertEqual(2, self._finds())
+        # A forked worker, as Ansible runs for each task and host, reads the result stored by the first lookup
+        pid = os.fork()
+        if pid == 0:
+            try:
+                result = lookup_mongodb.LookupModule().run([self._term(filter={'name': 'host1'})], {}, cache=True)
+                os._exit(0 if result == [{'_id': 1, 'name': 'host1'}] and self._finds() == 2 else 1)
+            except BaseException:
+                os._exit(2)
+        self.assertEqual(0, os.waitpid(pid, 0)[1])
+        path = os.path.join(self.directory, 'ansible-mongodb-lookup-%d' % os.getuid())
+        self.assertEqual(0o700, os.stat(path).st_mode & 0o777)
+
+    def test_cache_ttl(self):
+        self._populate(3)
+        now = [1000.0]
+        original_time = lookup_mongodb.time.time
+        try:
+            lookup_mongodb.time.time = lambda: now[0]
+            lookup = lookup_mongodb.LookupModule()
+            lookup.run([self._term()], {}, cache=True, cache_ttl=30)
+            now[0] += 29
+            lookup.run([self._term()], {}, cache=True, cache_ttl=30)
+            self.assertEqual(2, self._finds())
+            now[0] += 1
+            lookup.run([self._term()], {}, cache=True, cache_ttl=30)
+            self.assertEqual(3, self._finds())
+        finally:
+            lookup_mongodb.time.time = original_time
+
+    def test_cache_max_entries(self):
+        self._populate(3)
+        lookup = lookup_mongodb.LookupModule()
+        for name in ['host0', 'host1', 'host2', 'host0']:
+            lookup.run([self._term(filter={'name': name})], {}, cache=True, cache_max_entries=2)
+        # host0 was dropped to make room for host2
+        self.assertEqual(5, self._finds())
+        self.assertEqual(2, len(os.listdir(lookup_mongodb.private_dir(lookup_mongodb._RESULTS_DIR))))
+        lookup.run([self._term(filter={'name': 'host2'})], {}, cache=True, cache_max_entries=2)
+        self.assertEqual(5, self._finds())
+
+    def test_parallel_keeps_term_order(self):
+        lookup = lookup_mongodb.LookupModule()
+        terms = [self._term(connection_string='mongodb://shard%d:27017' % shard, limit=0) for shard in range(5)]
+        lookup.run(terms, {})
+        for shard, client in enumerate(FakeMongoClient.instances):
+            client['test']['rs'].docs = [{'_id': shard}]
+            # The first shards answer last
+            client['test']['rs'].delay = (5 - shard) * 0.02
+        threads = set()
+        original_read_cursor = lookup._read_cursor
+
+        def read_cursor(*args):
+            threads.add(threading.current_thread().name)
+            return original_read_cursor(*args)
+
+        lookup._read_cursor = read_cursor
+        result = lookup.run(terms, {}, parallel=3)
+        self.assertEqual([{'_id': shard} for shard in range(5)], result)
+        self.assertEqual(3, len(threads))
+        self.assertEqual(5, len(FakeMongoClient.instances))
+
+    def test_parallel_error_names_term(self):
+        lookup = lookup_mongodb.LookupModule()
+        terms = [self._term(), self._term(database='other'), self._term(collection='broken')]
+        lookup.run(terms, {})
+        FakeMongoClient.instances[0]['test']['broken'].error = ValueError('boom')
+        with self.assertRaisesRegex(AnsibleError, r'term 2 \(test.broken\) failed: boom'):
+            lookup.run(terms, {}, parallel=4)
+
+    def test_operations(self):
+        self._populate(4)
+        self._collection().docs.append({'_id': 4, 'name': 'host0', 'seen': datetime.datetime(1970, 1, 2)})
+        result = lookup_mongodb.LookupModule().run([
+            self._term(operation='count', filter={'name': 'host0'}, max_time_ms=500),
+            self._term(operation='estimated_count'),
+            self._term(operation='distinct', field='name'),
+            self._term(operation='distinct', field='seen', filter={'_id': 4}),
+        ], {})
+        self.assertEqual([2, 5, ['host0', 'host1', 'host2', 'host3'], [86400.0]], result)
+        calls = [call for call in self._collection().calls if call[0] != 'find']
+        self.assertEqual([('count_documents', {'name': 'host0'}, {'maxTimeMS': 500}),
+                          ('estimated_document_count', None, {}),
+                          ('distinct', {}, {}),
+                          ('distinct', {'_id': 4}, {})], calls)
+
+    def test_operation_errors(self):
+        lookup = lookup_mongodb.LookupModule()
+        with self.assertRaisesRegex(AnsibleError, 'operation must be one of'):
+            lookup.run([self._term(operation='remove')], {})
+        with self.assertRaisesRegex(AnsibleError, r'missing mandatory parameter \[field\]'):
+            lookup.run([self._term(operation='distinct')], {})
+        with self.assertRaisesRegex(AnsibleError, 'use operation count with a filter'):
+            lookup.run([self._term(operation='estimated_count', filter={})], {})
+        with self.assertRaisesRegex(AnsibleError, 'sort cannot be used with operation count'):
+            lookup.run([self._term(operation='count', sort=[['a', 'ASCENDING']])], {})
+        with self.assertRaisesRegex(AnsibleError, 'aggregate cannot be used with operation count'):
+            lookup.run([self._term(operation='count', aggregate=[])], {})
+
+    def test_hint_comment_max_time_ms(self):
+        self._populate(3)
+        lookup_mongodb.LookupModule().run([self._term(hint=[['name', 'ASCENDING']], comment='inventory', max_time_ms=100)], {})
+        call = self._collection().calls[-1]
+        self.assertEqual({'hint': [['name', 1]], 'comment': 'inventory', 'max_time_ms': 100}, call[2])
+
+        # Key patterns with integer directions are passed through
+        lookup_mongodb.LookupModule().run([self._term(hint=[['name', -1], ['_id', 1]])], {})
+        self.assertEqual([['name', -1], ['_id', 1]], self._collection().calls[-1][2]['hint'])
+
+    def test_explain(self):
+        self._populate(3)
+        result = lookup_mongodb.LookupModule().run([self._term(explain=True, filter={'name': 'host1'})], {})
+        self.assertEqual([{'winningPlan': {'stage': 'COLLSCAN'}, 'executionStats': {'nReturned': 1, 'totalDocsExamined': 1}}], result)
+
+        pipeline = [{'$match': {'name': 'host1'}}, {'$group': {'_id': '$name'}}]
+        term = self._term(explain=True, aggregate=pipeline, hint=[['name', 'ASCENDING']], max_time_ms=100, batch_size=10)
+        result = lookup_mongodb.LookupModule().run([term], {})
+        self.assertEqual([{'winningPlan': {'stage': 'IXSCAN'}, 'executionStats': {'nReturned': 1}}], result)
+        command = self._collection().database.commands[-1]
+        self.assertEqual('executionStats', command['verbosity'])
+        self.assertEqual({'aggregate': 'rs', 'pipeline': pipeline, 'cursor': {}, 'maxTimeMS': 100, 'hint': {'name': 1}},
+                         command['explain'])
+
+        with self.assertRaisesRegex(AnsibleError, 'explain cannot be used with operation count'):
+            lookup_mongodb.LookupModule().run([self._term(explain=True, operation='count')], {})
+
+    def test_output_raw_extjson(self):
+        self._populate(2)
+        self._collection().docs[0]['started'] = datetime.datetime(2020, 1, 1)
+        self._collection().docs[1]['oid'] = bson.ObjectId('5f1d7c0e9b1e8a3d4c2b1a00')
+        result = lookup_mongodb.LookupModule().run([self._term(output='raw_extjson', max_bytes=1000)], {})
+        self.assertEqual(['{"_id": 0, "name": "host0", "started": {"$date": "2020-01-01T00:00:00Z"}}',
+                          '{"_id": 1, "name": "host1", "oid": {"$oid": "5f1d7c0e9b1e8a3d4c2b1a00"}}'], result)
+        with self.assertRaisesRegex(AnsibleError, 'output must be one of'):
+            lookup_mongodb.LookupModule().run([self._term(output='xml')], {})
+        with self.assertRaisesRegex(AnsibleError, 'raw_extjson is only supported'):
+            lookup_mongodb.LookupModule().run([self._term(output='raw_extjson', operation='count')], {})
+
+    def _typed_document(self):
+        return {
+            '_id': bson.ObjectId('5f1d7c0e9b1e8a3d4c2b1a00'),
+            'started': datetime.datetime(2020, 7, 26, 12, 30, 15, 250000),
+            'price': bson.Decimal128('1234567890.123456789012345678'),
+            'payload': bson.Binary(b'abc', 0),
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'uuid_binary': bson.Binary(uuid.UUID('12345678-1234-5678-1234-567812345678').bytes, 4),
+            'optime': bson.Timestamp(1595766615, 3),
+            'count': 3,
+        }
+
+    def test_convert_iso8601(self):
+        result = lookup_mongodb.LookupModule().convert_mongo_result_to_valid_json(self._typed_document(), 'iso8601')
+        self.assertEqual({
+            '_id': '5f1d7c0e9b1e8a3d4c2b1a00',
+            'started': '2020-07-26T12:30:15.250000Z',
+            'price': '1234567890.123456789012345678',
+            'payload': 'YWJj',
+            'uuid': '12345678-1234-5678-1234-567812345678',
+            'uuid_binary': '12345678-1234-5678-1234-567812345678',
+            'optime': {'t': 1595766615, 'i': 3},
+            'count': 3,
+        }, result)
+        # Binary subtype 0 as returned by the driver
+        decoded = bson.decode(bson.encode({'payload': bson.Binary(b'hello', 0)}))
+        self.assertIs(bytes, type(decoded['payload']))
+        self.assertEqual({'payload': 'aGVsbG8='}, lookup_mongodb.LookupModule().convert_mongo_result_to_valid_json(decoded, 'iso8601'))
+        aware = datetime.datetime(2020, 7, 26, 14, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+        self.assertEqual('2020-07-26T12:30:00Z', lookup_mongodb.LookupModule().convert_mongo_result_to_valid_json(aware, 'iso8601'))
+
+    def test_convert_canonical_extjson(self):
+        result = lookup_mongodb.LookupModule().convert_mongo_result_to_valid_json(self._typed_document(), 'canonical_extjson')
+        self.assertEqual({'$oid': '5f1d7c0e9b1e8a3d4c2b1a00'}, result['_id'])
+        self.assertEqual({'$date': {'$numberLong': '1595766615250'}}, result['started'])
+        self.assertEqual({'$numberDecimal': '1234567890.123456789012345678'}, result['price'])
+        self.assertEqual({'$timestamp': {'t': 1595766615, 'i': 3}}, result['optime'])
+        self.assertEqual({'$numberInt': '3'}, result['count'])
+        self.assertEqual({'$binary': {'base64': 'EjRWeBI0VngSNFZ4EjRWeA==', 'subType': '04'}}, result['uuid'])
+
+    def test_output_applies_to_documents_and_distinct(self):
+        self._populate(2)
+        self._collection().docs[0]['started'] = datetime.datetime(2020, 1, 1)
+        result = lookup_mongodb.LookupModule().run([self._term(output='iso8601', filter={'_id': 0}),
+                                                    self._term(output='iso8601', operation='distinct', field='started')], {})
+        self.assertEqual([{'_id': 0, 'name': 'host0', 'started': '2020-01-01T00:00:00Z'}, ['2020-01-01T00:00:00Z']], result)
+
+
+if __name__ == '__main__':
+    unittest.main()